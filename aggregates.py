@@ -0,0 +1,188 @@
+"""
+All the dots of one tick at once: how many are on each cell, how many have each value, and the list of them sorted.
+
+The debugger shows them in panels that can have thousands of rows, so
+everything is kept sorted as the dots change and the panels only read the
+rows they show.
+"""
+
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Tuple
+
+from ticks import STATE_NAMES
+
+SORT_KEYS = ('id', 'value', 'state')
+
+
+class SortedList:
+    """A list kept sorted, where the items are added and removed one at a time with a binary search."""
+
+    def __init__(self, items=()):
+        self.items = sorted(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def add(self, item):
+        insort(self.items, item)
+
+    def remove(self, item):
+        i = bisect_left(self.items, item)
+        if i < len(self.items) and self.items[i] == item:
+            del self.items[i]
+
+
+class DotAggregates:
+    """
+    The dots of one tick of a history, counted by cell and by value, and sorted by one of SORT_KEYS.
+
+    move_to() goes from tick to tick with the changes of the history. A change
+    costs about as much as CHANGE_COST dots of a frame to sort again, so when
+    there are more changes than that, or when going back in time, the whole
+    frame of the tick is read again instead.
+    """
+
+    CHANGE_COST = 8
+    MIN_CHANGES = 64  # changes that can always be applied, for the ticks with few dots
+
+    def __init__(self, sort_key=SORT_KEYS[0]):
+        self.sort_key = sort_key
+        self.tick = -1
+        self._clear()
+
+    def _clear(self):
+        self.dots = {}  # type: Dict[int, tuple]  # uid -> ticks.Frame.row_tuple()
+        self.cells = Counter()  # type: Dict[Tuple[int, int], int]
+        self.values = Counter()  # type: Dict[object, int]
+        # (-count, row, col) of the cells with dots, the busiest first
+        self.busiest = SortedList()
+        # the distinct values of the dots
+        self.distinct = SortedList()
+        # (key, uid) of all the dots, sorted by sort_key
+        self.sorted = SortedList()
+
+    def __len__(self):
+        return len(self.dots)
+
+    def move_to(self, history, tick):
+        """Aggregate the dots of the tick of a ticks.TickHistory, -1 for no dots."""
+        if tick == self.tick:
+            return
+        if tick < 0:
+            self.tick = -1
+            self._clear()
+            return
+
+        if history.first <= self.tick < tick:
+            deltas = []
+            budget = max(self.MIN_CHANGES, len(self.dots) // self.CHANGE_COST)
+            for index in range(self.tick + 1, tick + 1):
+                changes, deaths = history.delta(index)
+                budget -= len(changes) + len(deaths)
+                if budget < 0:
+                    break
+                deltas.append((changes, deaths))
+            else:
+                for changes, deaths in deltas:
+                    self._apply(changes, deaths)
+                self.tick = tick
+                return
+
+        frame = history[tick]
+        self._build(map(frame.row_tuple, range(len(frame))))
+        self.tick = tick
+
+    def add(self, tick, changes, deaths):
+        """Nothing to do as the ticks are recorded, they are aggregated when they are shown."""
+
+    def truncate(self, length, dots):
+        """The history forgot the ticks from length onwards, ours is read again if it was one of them."""
+        if self.tick >= length:
+            self.tick = -1
+            self._clear()
+
+    def sort_by(self, key):
+        """Sort the dots by another of SORT_KEYS."""
+        self.sort_key = key
+        self.sorted = SortedList(self._sort_item(row) for row in self.dots.values())
+
+    def row(self, index):
+        """The row_tuple() of the dot at this index once sorted."""
+        return self.dots[self.sorted[index][1]]
+
+    def max_count(self):
+        """The number of dots of the most common value."""
+        return max(self.values.values(), default=0)
+
+    def _sort_item(self, row):
+        uid, _, _, id_, value, state, _ = row
+        if self.sort_key == 'value':
+            return value, uid
+        if self.sort_key == 'state':
+            return STATE_NAMES[state], uid
+        return id_, uid
+
+    def _build(self, rows):
+        self._clear()
+        self.dots = {row[0]: row for row in rows}
+        self.cells.update((row[1], row[2]) for row in self.dots.values())
+        self.values.update(row[4] for row in self.dots.values())
+        self.busiest = SortedList((-count, line, col) for (col, line), count in self.cells.items())
+        self.distinct = SortedList(self.values)
+        self.sorted = SortedList(self._sort_item(row) for row in self.dots.values())
+
+    def _apply(self, changes, deaths):
+        for uid in deaths:
+            row = self.dots.pop(uid, None)
+            if row is not None:
+                self._count_cell(row, -1)
+                self._count_value(row, -1)
+                self.sorted.remove(self._sort_item(row))
+
+        for row in changes:
+            last = self.dots.get(row[0])
+            self.dots[row[0]] = row
+            if last is None:
+                self._count_cell(row, 1)
+                self._count_value(row, 1)
+                self.sorted.add(self._sort_item(row))
+                continue
+
+            # most dots only move, their value and place in the list stay the same
+            if last[1:3] != row[1:3]:
+                self._count_cell(last, -1)
+                self._count_cell(row, 1)
+            if last[4] != row[4]:
+                self._count_value(last, -1)
+                self._count_value(row, 1)
+            item, last_item = self._sort_item(row), self._sort_item(last)
+            if item != last_item:
+                self.sorted.remove(last_item)
+                self.sorted.add(item)
+
+    def _count_cell(self, row, added):
+        col, line = row[1], row[2]
+        count = self.cells[col, line]
+        if count:
+            self.busiest.remove((-count, line, col))
+        count += added
+        if count:
+            self.cells[col, line] = count
+            self.busiest.add((-count, line, col))
+        else:
+            del self.cells[col, line]
+
+    def _count_value(self, row, added):
+        value = row[4]
+        count = self.values[value] + added
+        if count:
+            if count == added:
+                self.distinct.add(value)
+            self.values[value] = count
+        else:
+            del self.values[value]
+            self.distinct.remove(value)
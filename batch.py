@@ -0,0 +1,180 @@
+"""
+Run many programs without display, each in a process of a pool, to test them all at once.
+
+Each program runs in its own interpreter with a CallbacksRelay, as in the
+debugger, but its ticks are only counted and written to a trace. The trace is
+kept when the program fails or reaches the tick limit, to open it in the
+debugger with --replay, and deleted otherwise.
+"""
+
+import contextlib
+import glob
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+from export import worker_environ
+
+DEFAULT_MAX_TICKS = 100000
+PREFETCH = 4096  # the worker takes the ticks by big batches, it does nothing else
+
+OK = 'ok'
+ERROR = 'error'
+TICK_LIMIT = 'tick limit'
+
+
+def find_programs(patterns):
+    """The .dots files of the directories and the files matching the glob patterns, without repetition."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, '**', '*.dots'), recursive=True)))
+        else:
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    return list(dict.fromkeys(os.path.normpath(path) for path in paths))
+
+
+def trace_names(paths):
+    """A name for the trace of each program, from its file name, with a number when two have the same."""
+    names = []
+    seen = set()
+    for path in paths:
+        base = os.path.splitext(os.path.basename(path))[0]
+        name, i = base, 1
+        while name in seen:
+            i += 1
+            name = '{}-{}'.format(base, i)
+        seen.add(name)
+        names.append(name + '.trace')
+    return names
+
+
+def record_ticks(relay, writer, max_ticks, seconds=None, store=None):
+    """
+    Write the ticks of a CallbacksRelay and their outputs to a trace, until the program
+    ends, or for max_ticks microticks, or for about `seconds`.
+
+    :param tracefile.TraceWriter writer:
+    :param ticks.TickStore store: where the ticks are also kept, if given
+    :return: the number of ticks written
+    """
+    start = time.perf_counter()
+    log = relay.output_log
+    written = 0  # outputs already in the trace
+    count = 0
+    while count < max_ticks and (seconds is None or time.perf_counter() - start < seconds):
+        frames = relay.get_ticks(max_ticks - count, wait=True)
+        if not frames:
+            break
+        for frame in frames:
+            # the outputs of a tick are printed while it is computed, before it is given
+            while written < len(log) and log[written][0] <= frame.tick:
+                writer.write_output(log[written][1])
+                written += 1
+            writer.write_tick(frame)
+            if store is not None:
+                store.append(frame)
+        count += len(frames)
+    return count
+
+
+def run_program(path, max_ticks, trace_path):
+    """
+    Run a program until it ends or for max_ticks microticks, and write its ticks to trace_path.
+
+    :return: a dict with the program, its status (OK, ERROR or TICK_LIMIT), the
+        microticks computed, the wall time in seconds, what it printed, the errors
+        and the path of the trace if it was kept
+    """
+    # imported here, the debugger imports this module
+    from checkpoints import Checkpoints
+    from debugger import CallbacksRelay
+    from tracefile import TraceWriter
+    from dots.environment import Env
+    from dots.exceptions import DotsExit
+    from dots.interpreter import AsciiDotsInterpreter
+
+    result = {'program': path, 'status': OK, 'microticks': 0, 'seconds': 0.0, 'output': '', 'errors': [],
+              'trace': None}
+    start = time.perf_counter()
+
+    env = Env()
+    # nobody goes back in time, one checkpoint is enough
+    relay = CallbacksRelay(env, PREFETCH, Checkpoints(interval=max_ticks + 1))
+    crashes = []
+
+    def interpret():
+        try:
+            interpreter.run()
+        except DotsExit:
+            pass
+        except Exception:
+            # the interpreter already called relay.on_finish(), so we don't wait for more ticks
+            crashes.append(traceback.format_exc())
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            program = f.read()
+        program_dir = os.path.dirname(os.path.abspath(path))
+
+        with TraceWriter(trace_path, program, program_dir) as writer:
+            interpreter = AsciiDotsInterpreter(env, program, program_dir, True)
+            thread = threading.Thread(target=interpret, daemon=True)
+            thread.start()
+
+            result['microticks'] = record_ticks(relay, writer, max_ticks)
+            if result['microticks'] >= max_ticks and (not relay.finished or relay.pending):
+                result['status'] = TICK_LIMIT
+
+            relay.on_finish()
+            thread.join()
+    except Exception:
+        crashes.append(traceback.format_exc())
+
+    while not relay.errors.empty():
+        result['errors'].append(relay.errors.get())
+    result['errors'].extend(crashes)
+    if result['errors']:
+        result['status'] = ERROR
+
+    result['output'] = ''.join(str(text) for _, text in relay.output_log)
+    result['seconds'] = time.perf_counter() - start
+    if result['status'] == OK:
+        os.remove(trace_path)
+    elif os.path.exists(trace_path):
+        result['trace'] = trace_path
+    return result
+
+
+def _run_job(job):
+    # the prints of the programs would be mixed with the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return run_program(*job)
+
+
+def run_batch(paths, trace_dir, max_ticks=DEFAULT_MAX_TICKS, workers=None, progress=None):
+    """
+    Run all the programs, in a pool of `workers` processes (one per core by default).
+
+    :param str trace_dir: where the traces are written, it is created if needed
+    :param progress: called with each result, as soon as the program is done
+    :return: the results of run_program(), in the order of the paths
+    """
+    os.makedirs(trace_dir, exist_ok=True)
+    jobs = [(path, max_ticks, os.path.join(trace_dir, name)) for path, name in zip(paths, trace_names(paths))]
+    if not jobs:
+        return []
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with worker_environ():
+        with context.Pool(min(workers or os.cpu_count() or 1, len(jobs))) as pool:
+            # one program at a time, they can take very different times
+            for result in pool.imap_unordered(_run_job, jobs, 1):
+                results[result['program']] = result
+                if progress is not None:
+                    progress(result)
+
+    return [results[path] for path in paths]
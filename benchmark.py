@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""
+Benchmarks of the path from the interpreter to the display, without window.
+
+For the samples and a few generated stress programs, it measures the microticks
+per second that go through the CallbacksRelay into the tick store, the bytes per
+tick in memory and in a trace, and the time to render a frame at several zoom
+levels, with the time to show the first frame. The results are written as
+JSON, to compare them between versions.
+
+    python benchmark.py --output before.json
+"""
+
+import contextlib
+import glob
+import json
+import os
+import platform
+import tempfile
+import time
+
+# the display is not needed, pygame draws on an offscreen surface
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import click
+
+import gui
+from batch import record_ticks
+from debugger import CallbacksRelay
+from mapmodel import load_map_model
+from ticks import TickStore
+from tracefile import TraceWriter
+from dots.environment import Env
+from dots.interpreter import AsciiDotsInterpreter
+
+DEFAULT_TICKS = 5000
+DEFAULT_FRAMES = 30
+DEFAULT_SECONDS = 20  # at most, for each program
+FONT_SIZES = (8, 24, 48)
+
+# a dot going around a loop forever
+LOOP = ['/-\\ ',
+        '. | ',
+        '\\-/ ']
+# a dot printing its value at each lap
+PRINT_LOOP = ['/-$#\\ ',
+              '.   | ',
+              '\\---/ ']
+
+
+def tile(cell, columns, rows):
+    """A program made of columns x rows copies of a cell."""
+    return '\n'.join(line * columns for _ in range(rows) for line in cell)
+
+
+def stress_programs():
+    """The generated programs, by name."""
+    return {
+        'many_dots': tile(LOOP, 50, 20),
+        # a few dots in a map of 100k chars that they never visit
+        'huge_map': tile(LOOP, 4, 1) + '\n' + '\n'.join('0123456789' * 40 for _ in range(250)),
+        'heavy_output': tile(PRINT_LOOP, 20, 5),
+    }
+
+
+def bench_program(name, program, program_dir, ticks, seconds, frames):
+    """Run the program for `ticks` microticks (or `seconds`) and render `frames` frames, return the measures."""
+    env = Env()
+    relay = CallbacksRelay(env)
+    interpreter = AsciiDotsInterpreter(env, program, program_dir, True)
+    store = TickStore()
+
+    with tempfile.TemporaryDirectory(prefix='dots-bench-') as directory:
+        trace_path = os.path.join(directory, name + '.trace')
+        start = time.perf_counter()
+        interpreter.run(run_in_separate_thread=True, make_thread_daemon=True)
+        with TraceWriter(trace_path, program, program_dir) as writer:
+            record_ticks(relay, writer, ticks, seconds, store)
+            elapsed = time.perf_counter() - start
+            relay.on_finish()
+        trace_size = os.path.getsize(trace_path)
+
+    recorded = max(1, len(store))
+    return {
+        'map_cells': sum(len(line) for line in env.world.map),
+        'microticks': len(store),
+        'microticks_per_second': len(store) / elapsed,
+        'dots_last_tick': len(store[-1]) if len(store) else 0,
+        'outputs': len(relay.output_log),
+        'store_bytes_per_tick': store.memory() / recorded,
+        'trace_bytes_per_tick': trace_size / recorded,
+        'first_frame_ms': bench_first_frame(env, store),
+        'render_ms': bench_render(env, store, frames),
+    }
+
+
+def bench_first_frame(env, store):
+    """The time from the creation of the debugger to its first frame, with the map model already cached."""
+    load_map_model(env.world, gui.char_color)
+    start = time.perf_counter()
+    debugger = gui.PygameDebugger(env, False)
+    debugger.ticks = store
+    debugger.current_tick = len(store) - 1
+    debugger.render()
+    return 1000 * (time.perf_counter() - start)
+
+
+def bench_render(env, store, frames):
+    """The mean and max time to render the last tick, at each font size."""
+    debugger = gui.PygameDebugger(env, False)
+    debugger.ticks = store
+    debugger.current_tick = len(store) - 1
+
+    results = {}
+    for size in FONT_SIZES:
+        gui.MAINFONT.set_size(size)
+        gui.BIGFONT.set_size(size * 2)
+        gui.SMALLFONT.set_size(size * 0.75)
+        debugger.offset = debugger.get_default_offset()
+
+        times = []
+        for _ in range(frames):
+            start = time.perf_counter()
+            debugger.render()
+            times.append(1000 * (time.perf_counter() - start))
+        # the first frame draws the tiles and glyphs, it is apart
+        results[str(size)] = {'first': times[0], 'mean': sum(times[1:]) / max(1, len(times) - 1),
+                              'max': max(times[1:], default=times[0])}
+
+    gui.MAINFONT.set_size(gui.DEFAULT_FONT_SIZE)
+    gui.BIGFONT.set_size(gui.DEFAULT_FONT_SIZE * 2)
+    gui.SMALLFONT.set_size(gui.DEFAULT_FONT_SIZE * 0.75)
+    return results
+
+
+@click.command()
+@click.option('--ticks', default=DEFAULT_TICKS, show_default=True, help='Microticks to run for each program.')
+@click.option('--seconds', default=DEFAULT_SECONDS, show_default=True, help='Time limit to run each program.')
+@click.option('--frames', default=DEFAULT_FRAMES, show_default=True, help='Frames rendered at each zoom level.')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='Where to write the JSON results.')
+@click.argument('programs', nargs=-1)
+def main(ticks, seconds, frames, output, programs):
+    """Benchmark the PROGRAMS, by default the samples and the stress programs."""
+    to_run = {}
+    if programs:
+        paths = programs
+    else:
+        paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples', '*.dots')))
+        for name, program in stress_programs().items():
+            to_run[name] = program, os.getcwd()
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            to_run[os.path.basename(path)] = f.read(), os.path.dirname(os.path.abspath(path))
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ticks': ticks,
+        'seconds': seconds,
+        'programs': {},
+    }
+    for name, (program, program_dir) in sorted(to_run.items()):
+        click.echo('{}...'.format(name), err=True)
+        # the prints of the programs would be mixed with the results
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results['programs'][name] = bench_program(name, program, program_dir, ticks, seconds, frames)
+
+    json.dump(results, output, indent=2, sort_keys=True)
+    output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import operator
+
+from dots.vector import Pos
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt,
+}
+
+
+class Breakpoint:
+    """
+    A condition that stops the execution when running to the next breakpoint.
+
+    Breakpoints are checked on the interpreter thread with the live dots, or on
+    recorded ticks (ticks.Frame). Both give objects with a pos, an id and a value.
+    """
+
+    def check(self, dots, output):
+        """
+        True if the execution must stop on this tick.
+
+        :param dots: the dots alive at this tick
+        :param bool output: whether this tick printed something
+        """
+        return any(self.check_dot(dot) for dot in dots)
+
+    def check_frame(self, frame, output):
+        """Same as check() but for a recorded tick."""
+        return self.check(frame, output)
+
+    def check_dot(self, dot):
+        return False
+
+    def key(self):
+        """Two breakpoints with the same key are the same."""
+        return (type(self),) + tuple(sorted(vars(self).items()))
+
+    def __eq__(self, other):
+        return isinstance(other, Breakpoint) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+
+class CellBreakpoint(Breakpoint):
+    """Stop when a dot is on a given cell of the map."""
+
+    def __init__(self, pos):
+        self.pos = Pos(pos)
+
+    def check_dot(self, dot):
+        return dot.pos == self.pos
+
+    def check_frame(self, frame, output):
+        return bool(frame.at(self.pos))
+
+    def __str__(self):
+        return 'cell={},{}'.format(*self.pos)
+
+
+class ConditionBreakpoint(Breakpoint):
+    """Stop when the id or the value of a dot satisfies a comparison, like value == 0."""
+
+    def __init__(self, attribute, op, operand):
+        if attribute not in ('id', 'value'):
+            raise ValueError('Breakpoints can only be on the id or the value of dots, not {}'.format(attribute))
+        if op not in OPERATORS:
+            raise ValueError('Unknown comparison: {}'.format(op))
+
+        self.attribute = attribute
+        self.op = op
+        self.operand = operand
+
+    def check_dot(self, dot):
+        return OPERATORS[self.op](getattr(dot, self.attribute), self.operand)
+
+    def __str__(self):
+        return '{}{}{}'.format(self.attribute, self.op, self.operand)
+
+
+class OutputBreakpoint(Breakpoint):
+    """Stop when the program prints something."""
+
+    def check(self, dots, output):
+        return output
+
+    check_frame = check
+
+    def __str__(self):
+        return 'output'
+
+
+def parse_number(text):
+    """A number given on the command line: an int, or a float like 0.5 or 1e3."""
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_breakpoint(text):
+    """
+    Make a breakpoint from its description.
+
+    The descriptions are 'output', 'cell=col,row' or a comparison of the id or
+    value of the dots with a number, like 'value==0' or 'id>=3'.
+    """
+    text = text.replace(' ', '')
+    if text == 'output':
+        return OutputBreakpoint()
+    if text.startswith('cell='):
+        col, row = text[len('cell='):].split(',')
+        return CellBreakpoint((int(col), int(row)))
+
+    # the longest operators first, so '<=' is not read as '<'
+    for op in sorted(OPERATORS, key=len, reverse=True):
+        attribute, found, operand = text.partition(op)
+        if found:
+            return ConditionBreakpoint(attribute, op, parse_number(operand))
+
+    raise ValueError('Invalid breakpoint: {}'.format(text))
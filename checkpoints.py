@@ -0,0 +1,87 @@
+import copy
+import threading
+from bisect import bisect_right
+from typing import List
+
+DEFAULT_INTERVAL = 1000
+DEFAULT_MAX_COUNT = 64
+
+
+class Checkpoint:
+    """
+    A copy of the whole state of the interpreter at a microtick.
+
+    The world doesn't change during the execution, so only the dots are copied,
+    with their states (and so the waits of the dots in TwoDotStates) and stacks.
+    """
+
+    def __init__(self, tick, env, recorder):
+        """
+        :param int tick: the microtick that was just computed
+        :param dots.environment.Env env:
+        :param ticks.DotRecorder recorder: gives the uids of the dots, they are kept with them
+        """
+        self.tick = tick
+        self.uids = [recorder.uid(dot) for dot in env.dots]
+        self.next_uid = recorder.next_uid
+        # the env is shared, not copied
+        self.dots = copy.deepcopy(env.dots, {id(env): env})
+
+    def restore(self, recorder):
+        """
+        New dots in the state of the checkpoint, that can be used several times.
+
+        The recorder is set back to this tick, so the dots get the same uids as the first time.
+        :rtype: list[dots.dot.Dot]
+        """
+        env = self.dots[0].env if self.dots else None
+        dots = copy.deepcopy(self.dots, {id(env): env})
+        recorder.register(dots, self.uids, self.next_uid)
+        return dots
+
+
+class Checkpoints:
+    """
+    The checkpoints of an execution, taken every `interval` microticks.
+
+    There are never more than max_count of them: when there are too many, one out
+    of two is forgotten and the interval doubles. Long executions have
+    fewer checkpoints, but re-computing any tick stays proportional to its age.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, max_count=DEFAULT_MAX_COUNT):
+        self.interval = interval
+        self.max_count = max(2, max_count)
+        self._checkpoints = []  # type: List[Checkpoint]
+        self._ticks = []  # type: List[int]
+        # taken by the interpreter, used by the gui
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    def due(self, tick):
+        """Whether a checkpoint should be taken at this microtick."""
+        return not self._ticks or tick >= self._ticks[-1] + self.interval
+
+    def add(self, checkpoint):
+        """Add the checkpoint of a microtick after all the others."""
+        with self._lock:
+            self._checkpoints.append(checkpoint)
+            self._ticks.append(checkpoint.tick)
+
+            if len(self._checkpoints) > self.max_count:
+                # the first one is kept, it's the only one before the start
+                self._checkpoints = self._checkpoints[::2]
+                self._ticks = self._ticks[::2]
+                self.interval *= 2
+
+    def before(self, tick):
+        """
+        The last checkpoint taken at or before this microtick, or None.
+
+        :rtype: Checkpoint
+        """
+        with self._lock:
+            i = bisect_right(self._ticks, tick)
+            return self._checkpoints[i - 1] if i else None
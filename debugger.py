@@ -1,74 +1,423 @@
 #!/usr/bin/python3
 
-import copy
+import json
 import os
 import queue
-from time import sleep
+import threading
+import time
+from collections import deque
+from typing import List, Tuple
 
 import click
 
-import gui
+import breakpoints
+from batch import DEFAULT_MAX_TICKS, OK, find_programs, run_batch
+from checkpoints import Checkpoint, Checkpoints
+from export import DEFAULT_FONT_SIZE, DEFAULT_FPS, export_trace
+from outputs import OutputLog
+from process import ProcessRelay
+from profiling import profile_call
+from ticks import MAX_HISTORY, DotRecorder
+from tracefile import MappedTrace, TraceWriter
+from tracequery import TraceQuery
 from dots.interpreter import AsciiDotsInterpreter
 from dots.environment import Env
 from dots.callbacks import IOCallbacksStorage
+from dots.exceptions import DotsExit
+from dots.world import World
+
+
+DEFAULT_PREFETCH = 256
+MAX_PREFETCH = 2 ** 16  # ticks, when the playback asks to run further ahead
 
 
 class CallbacksRelay(IOCallbacksStorage):
     """Stores the outputs of the interpreter untill processed."""
 
-    def __init__(self, env):
+    def __init__(self, env, prefetch=DEFAULT_PREFETCH, checkpoints=None):
+        """
+        :param int prefetch: how many microticks the interpreter can run ahead of the viewer
+        :param checkpoints.Checkpoints checkpoints: where to keep the states to restart from
+        """
         super().__init__(env)
 
         self.errors = queue.Queue()
-        self._tick = None
-        self.outputs = queue.Queue()
+        self.output_log = OutputLog()
         self.inputs = queue.Queue()
 
+        # the ticks waiting to be taken by the gui, the interpreter blocks when it's full
+        self.prefetch = max(1, prefetch)
+        self._ticks = deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.recorder = DotRecorder()
+        self.microtick = 0  # the number of microticks computed
+
+        # when running to a breakpoint, the ticks are only checked, not given to the gui
+        self.breakpoints = []  # type: List[breakpoints.Breakpoint]
+        self.fast_forward = False
+        self.breakpoint_hit = None  # type: Tuple[int, breakpoints.Breakpoint]
+        self._output = False
+
+        # the execution can go back to a checkpoint, see restore()
+        self.checkpoints = checkpoints or Checkpoints()
+        self._restore = None  # type: Checkpoint
+        self._computed = 0  # the outputs before this microtick were already printed
+
         self.input_request = False
         self.finished = False
 
-    def get_tick(self, wait=False):
+    @property
+    def pending(self):
+        """Number of ticks computed but not yet taken."""
+        return len(self._ticks)
+
+    def get_ticks(self, count, wait=False, timeout=None):
+        """
+        Take at most count ticks at once.
+
+        If wait is True, block until at least one is available, or for at most timeout seconds. The list is
+        empty when there is no tick available and (when waiting) the interpreter finished.
+        """
+
+        with self._not_empty:
+            if wait:
+                self._not_empty.wait_for(lambda: self._ticks or self.finished, timeout)
 
-        if wait:
-            tick = None
-            while tick is None and not self.finished:
-                tick = self._tick
-        else:
-            tick = self._tick
+            count = min(count, len(self._ticks))
+            ticks = [self._ticks.popleft() for _ in range(count)]
+            self._not_full.notify_all()
+            return ticks
 
-        self._tick = None
-        return tick
+    def read_ahead(self, count):
+        """Let the interpreter run at least count ticks ahead of the viewer (up to MAX_PREFETCH)."""
+        with self._not_full:
+            self.prefetch = max(self.prefetch, min(count, MAX_PREFETCH))
+            self._not_full.notify_all()
 
     def on_error(self, error_text):
         self.errors.put(error_text)
 
+    def run_to_breakpoint(self):
+        """Let the interpreter run without giving its ticks until a breakpoint is hit."""
+        with self._lock:
+            self.breakpoint_hit = None
+            self.fast_forward = True
+            # the interpreter doesn't have to wait for the gui anymore
+            self._not_full.notify_all()
+
+    def stop_fast_forward(self):
+        self.fast_forward = False
+
+    def restore_before(self, tick):
+        """
+        Continue the execution from the last checkpoint at or before the microtick.
+
+        :return: the microtick of the checkpoint, it is the next tick given
+        """
+        checkpoint = self.checkpoints.before(tick)
+        self.restore(checkpoint)
+        return checkpoint.tick
+
+    def restore(self, checkpoint):
+        """
+        Continue the execution from a checkpoint.
+
+        The ticks not taken yet are dropped, the next one is the tick of the checkpoint.
+        The interpreter is started again if it had finished.
+        """
+        with self._lock:
+            self._ticks.clear()
+            self._restore = checkpoint
+            self._not_full.notify_all()
+            if not self.finished:
+                # the interpreter will restore it at its next microtick
+                return
+            self.finished = False
+        self._resume()
+
+    def _resume(self):
+        """Start again the interpreter that finished, from the checkpoint to restore."""
+        self._apply_restore()
+        self.env.interpreter.needs_shutdown = False
+        self.env.interpreter.run(run_in_separate_thread=True, make_thread_daemon=True)
+
+    def _apply_restore(self):
+        """Replace the dots by the ones of the checkpoint. Only on the interpreter thread, or when it is stopped."""
+        checkpoint = self._restore
+        self.env.dots[:] = checkpoint.restore(self.recorder)
+        self._computed = max(self._computed, self.microtick)
+        self.microtick = checkpoint.tick + 1
+        self.fast_forward = False
+        self.breakpoint_hit = None
+        self._output = False
+        self.output_log.truncate(checkpoint.tick + 1)
+
+        frame = self.recorder.snapshot(self.env.dots)
+        frame.tick = checkpoint.tick
+        with self._lock:
+            self._restore = None
+            self._ticks.append(frame)
+            self._not_empty.notify()
+
     def on_microtick(self, dot):
-        dots = [copy.copy(d) for d in self.env.dots]
-        self._tick = dots
+        if self._restore is not None:
+            # this tick was computed from the state before the restore
+            return self._apply_restore()
+
+        tick = self.microtick
+        self.microtick += 1
+        output, self._output = self._output, False
+
+        if self.checkpoints.due(tick):
+            self.checkpoints.add(Checkpoint(tick, self.env, self.recorder))
+
+        if self.fast_forward:
+            hit = next((bp for bp in tuple(self.breakpoints) if bp.check(self.env.dots, output)), None)
+            if hit is None:
+                return
+            self.breakpoint_hit = tick, hit
+            self.fast_forward = False
+
+        frame = self.recorder.snapshot(self.env.dots)
+        frame.tick = tick
+
+        with self._not_full:
+            # we wait until there is room for this tick
+            while (len(self._ticks) >= self.prefetch and not self.finished and not self.fast_forward
+                   and self._restore is None):
+                self._not_full.wait()
 
-        # we wait until somone got this tick
-        while self._tick is not None and not self.finished:
-            sleep(0.0001)  # could be pass but for profiler
+            if self._restore is None:
+                self._ticks.append(frame)
+                self._not_empty.notify()
+                return
+
+        self._apply_restore()
 
     def on_output(self, value):
-        self.outputs.put(value)
+        self._output = True
+        self.output_log.add(self.microtick, value)
+        # when computing again the ticks after a restore, their outputs were already printed
+        if self.microtick >= self._computed:
+            print(value, end='', flush=True)
+
+    def on_finish(self):
+        with self._lock:
+            # the gui went back while the program was ending (but not when the gui quits)
+            resume = self._restore is not None and threading.current_thread() is not threading.main_thread()
+            if not resume:
+                self.finished = True
+                # wake up everyone so nobody waits for a tick that will never come
+                self._not_empty.notify_all()
+                self._not_full.notify_all()
+            self.env.interpreter.terminate()
+
+        if resume:
+            self._resume()
+
+    def get_input(self, ascii_char=False):
+        return input()
+
+
+class RecordingRelay(IOCallbacksStorage):
+    """Write every microtick of the interpreter to a trace file, without display."""
+
+    def __init__(self, env, writer):
+        """
+        :param tracefile.TraceWriter writer:
+        """
+        super().__init__(env)
+
+        self.writer = writer
+        self.recorder = DotRecorder()
+
+    def on_error(self, error_text):
+        click.echo(error_text, err=True)
+
+    def on_microtick(self, dot):
+        self.writer.write_tick(self.recorder.snapshot(self.env.dots))
+
+    def on_output(self, value):
+        self.writer.write_output(value)
         print(value, end='', flush=True)
 
     def on_finish(self):
-        self.finished = True
         self.env.interpreter.terminate()
 
     def get_input(self, ascii_char=False):
         return input()
 
 
-@click.command()
-@click.argument('filename')
+class ReplayRelay(IOCallbacksStorage):
+    """Stands for the interpreter when a recorded trace is replayed: it has already finished."""
+
+    def __init__(self, env, trace):
+        """
+        :param tracefile.MappedTrace trace:
+        """
+        super().__init__(env)
+
+        self.errors = queue.Queue()
+        self.output_log = trace.outputs
+        self.finished = True
+        self.trace = trace
+
+        # everything is recorded, the debugger checks the breakpoints itself
+        self.breakpoints = []
+        self.fast_forward = False
+        self.breakpoint_hit = None
+        self.pending = 0
+
+    @property
+    def microtick(self):
+        return len(self.trace)
+
+    def get_ticks(self, count, wait=False, timeout=None):
+        return []
+
+    def read_ahead(self, count):
+        pass
+
+    def run_to_breakpoint(self):
+        pass
+
+    def stop_fast_forward(self):
+        pass
+
+    def on_finish(self):
+        self.trace.close()
+
+
+def record_trace(prog, program_dir, trace):
+    """Run the program at full speed and write all its microticks in the trace file."""
+    env = Env()
+    with TraceWriter(trace, prog, program_dir) as writer:
+        RecordingRelay(env, writer)
+        interpreter = AsciiDotsInterpreter(env, prog, program_dir, True)
+        try:
+            interpreter.run()
+        except DotsExit:
+            pass
+    click.echo('Recorded {} microticks in {}'.format(writer.ticks, trace), err=True)
+
+
+def run_debugger(debugger, profile=False):
+    """Run the debugger until it quits. With profile, the timings and cProfile stats are printed at the end."""
+    if not profile:
+        return debugger.run()
+
+    click.echo(profile_call(debugger.run, debugger.timings), err=True)
+    if debugger.first_frame is not None:
+        click.echo('First frame {:.0f} ms after the start'.format(1000 * debugger.first_frame), err=True)
+
+
+def replay_trace(trace, retina, breaks=(), profile=False, started=None):
+    """Open the debugger on a recorded trace."""
+    try:
+        trace = MappedTrace(trace)
+    except (OSError, ValueError) as e:
+        raise click.BadParameter(str(e), param_hint='--replay')
+
+    # imported only by the commands with a window, pygame takes a while to load
+    import gui
+    gui.open_window(retina)
+
+    env = Env()
+    ReplayRelay(env, trace).breakpoints.extend(breaks)
+    try:
+        program_dir = trace.get_program_dir()
+    except ValueError as e:
+        trace.close()
+        raise click.BadParameter(str(e), param_hint='--replay')
+    World(env, trace.program, program_dir)
+
+    debugger = gui.TraceDebugger(env, retina, trace, started)
+    run_debugger(debugger, profile)
+
+
+def run_in_process(prog, program_dir, retina, prefetch, history, breaks=(), profile=False, started=None):
+    """Open the debugger with the interpreter in a child process."""
+    # imported only by the commands with a window, pygame takes a while to load
+    import gui
+    gui.open_window(retina)
+
+    env = Env()
+    relay = ProcessRelay(env, prog, program_dir, prefetch)
+    relay.breakpoints.extend(breaks)
+    try:
+        World(env, prog, program_dir)
+        debugger = gui.PygameDebugger(env, retina, history, started)
+        run_debugger(debugger, profile)
+    finally:
+        relay.on_finish()
+
+
+class DefaultGroup(click.Group):
+    """Commands, where the default one runs when the first argument is not a command, like a program to debug."""
+
+    def __init__(self, *args, default=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default = default
+
+    def parse_args(self, ctx, args):
+        if not args or (args[0] not in self.commands and args[0] not in ctx.help_option_names):
+            args = [self.default] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup, default='debug')
+def main():
+    """Debug asciidots programs. The debug command is the default: debugger.py PROGRAM runs it."""
+
+
+@main.command()
+@click.argument('filename', required=False)
 @click.option('--retina', is_flag=True, default=False)
-def main(filename, retina):
+@click.option('--prefetch', default=DEFAULT_PREFETCH, show_default=True,
+              help='Number of microticks the interpreter can compute ahead of the display.')
+@click.option('--history', default=MAX_HISTORY, show_default=True,
+              help='Number of microticks kept in memory, the older ones are computed again from checkpoints.')
+@click.option('--process', 'in_process', is_flag=True, default=False,
+              help='Run the interpreter in another process, so it runs at full speed along the display.')
+@click.option('--profile', is_flag=True, default=False,
+              help='Print the time taken by each phase of the frames and the cProfile stats of the display at exit.')
+@click.option('--record', metavar='TRACE', help='Run without display and write every microtick to TRACE.')
+@click.option('--replay', metavar='TRACE', help='Open the debugger on a recorded TRACE instead of a program.')
+@click.option('--break', 'breaks', metavar='CONDITION', multiple=True,
+              help="Breakpoint for F5: 'output', 'cell=COL,ROW' or a condition like 'value==0' or 'id>=3'.")
+def debug(filename, retina, prefetch, history, in_process, profile, record, replay, breaks):
+    """Open the debugger on the program FILENAME, or on a recorded trace."""
+    started = time.perf_counter()
+    try:
+        breaks = [breakpoints.parse_breakpoint(b) for b in breaks]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--break')
+
+    if replay:
+        return replay_trace(replay, retina, breaks, profile, started)
+    if filename is None:
+        raise click.UsageError('Missing the program to debug.')
+
+    if record:
+        with open(filename, encoding='utf-8') as f:
+            prog = f.read()
+        return record_trace(prog, os.path.dirname(os.path.abspath(filename)), record)
+
+    if in_process:
+        with open(filename, encoding='utf-8') as f:
+            prog = f.read()
+        program_dir = os.path.dirname(os.path.abspath(filename))
+        return run_in_process(prog, program_dir, retina, prefetch, history, breaks, profile, started)
+
+    # imported only by the commands with a window, pygame takes a while to load
+    import gui
+    gui.open_window(retina)
     try:
         env = Env()
-        callbacks_relay = CallbacksRelay(env)
+        callbacks_relay = CallbacksRelay(env, prefetch)
+        callbacks_relay.breakpoints.extend(breaks)
 
         with open(filename, encoding='utf-8') as f:
             prog = f.read()
@@ -77,13 +426,154 @@ def main(filename, retina):
         interpreter = AsciiDotsInterpreter(env, prog, program_dir, True)
         interpreter.run(run_in_separate_thread=True)
 
-        debugger = gui.PygameDebugger(env, retina)
-        debugger.run()
+        debugger = gui.PygameDebugger(env, retina, history, started)
+        run_debugger(debugger, profile)
     except Exception as e:
         callbacks_relay.on_finish()
         interpreter.terminate()
         raise e
 
 
+@main.command()
+@click.argument('trace', type=click.Path(exists=True, dir_okay=False))
+@click.argument('output')
+@click.option('--start', default=0, show_default=True, help='First microtick exported.')
+@click.option('--stop', type=int, help='Microtick where the export stops (excluded), by default the end.')
+@click.option('--step', default=1, show_default=True, help='Export one microtick out of STEP.')
+@click.option('--font-size', default=DEFAULT_FONT_SIZE, show_default=True)
+@click.option('--fps', default=DEFAULT_FPS, show_default=True, help='Frames per second of the GIF.')
+@click.option('--workers', type=int, help='Number of processes that draw the frames, by default one per core.')
+def export(trace, output, start, stop, step, font_size, fps, workers):
+    """
+    Draw the microticks of a recorded TRACE in OUTPUT, a .gif or a directory of PNG images.
+
+    Record the trace first with --record. GIFs need Pillow, and are kept in
+    memory until written: for thousands of frames, export PNG images.
+    """
+    if step < 1:
+        raise click.BadParameter('must be at least 1', param_hint='--step')
+
+    def progress(done, total):
+        if done % 100 == 0 or done == total:
+            click.echo('\rExporting {}/{} frames'.format(done, total), nl=done == total, err=True)
+
+    try:
+        count = export_trace(trace, output, start, stop, step, font_size, fps, workers, progress)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='TRACE')
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo('Exported {} frames to {}'.format(count, output), err=True)
+
+
+@main.command()
+@click.argument('programs', nargs=-1, required=True)
+@click.option('--max-ticks', default=DEFAULT_MAX_TICKS, show_default=True,
+              help='Microticks after which a program is stopped.')
+@click.option('--workers', type=int, help='Number of programs run at once, by default one per core.')
+@click.option('--traces', default='traces', show_default=True,
+              help='Directory of the traces of the programs that fail or reach the tick limit.')
+@click.option('--json', 'json_output', type=click.File('w'),
+              help='Write all the results, with the outputs, in this file.')
+def batch(programs, max_ticks, workers, traces, json_output):
+    """
+    Run all the PROGRAMS without display, each in its own process.
+
+    PROGRAMS are .dots files, glob patterns or directories, searched for .dots
+    files. A line is printed for each program, and the errors. The traces kept
+    can be opened with --replay. The exit code is 1 if a program had an error.
+    """
+    paths = find_programs(programs)
+    if not paths:
+        raise click.UsageError('No program found.')
+
+    def progress(result):
+        click.echo('{:<10} {:>9} ticks {:>8.2f} s  {}'.format(
+            result['status'], result['microticks'], result['seconds'], result['program']))
+        for error in result['errors']:
+            click.echo(error.rstrip('\n'), err=True)
+
+    results = run_batch(paths, traces, max_ticks, workers, progress)
+
+    failed = sum(result['status'] != OK for result in results)
+    click.echo('{} programs, {} not ok'.format(len(results), failed), err=True)
+    if json_output:
+        json.dump(results, json_output, indent=2)
+        json_output.write('\n')
+    if any(result['errors'] for result in results):
+        raise SystemExit(1)
+
+
+@main.command()
+@click.argument('trace', type=click.Path(exists=True, dir_okay=False))
+@click.option('--above', metavar='VALUE', help='First microtick where the value of a dot is greater than VALUE.')
+@click.option('--below', metavar='VALUE', help='First microtick where the value of a dot is less than VALUE.')
+@click.option('--dot', 'uid', type=int, help='Only the values of this dot, by the uid shown in the debugger.')
+@click.option('--cell', metavar='COL,ROW', help='The microticks when at least one dot is on this cell.')
+@click.option('--outputs', is_flag=True, help='The microticks that print something, with what they print.')
+@click.option('--start', default=0, show_default=True, help='First microtick searched for --cell and --outputs.')
+@click.option('--stop', type=int, help='Microtick where --cell and --outputs stop (excluded), by default the end.')
+@click.option('--json', 'as_json', is_flag=True, help='Print the results as JSON.')
+def query(trace, above, below, uid, cell, outputs, start, stop, as_json):
+    """
+    Search a recorded TRACE without replaying it.
+
+    The answers come from the indexes written at the end of the trace, so they
+    are immediate even for huge traces. For example, the first microtick where
+    the dot 42 has a value above 1000:
+
+        debugger.py query primes.trace --above 1000 --dot 42
+    """
+    try:
+        thresholds = [(name, breakpoints.parse_number(value)) for name, value in (('above', above), ('below', below))
+                      if value is not None]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--above/--below')
+    try:
+        pos = tuple(int(x) for x in cell.split(',')) if cell else None
+        if pos is not None and len(pos) != 2:
+            raise ValueError('expected COL,ROW')
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--cell')
+    if not thresholds and pos is None and not outputs:
+        raise click.UsageError('Nothing to search, give --above, --below, --cell or --outputs.')
+
+    try:
+        searched = TraceQuery(trace)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='TRACE')
+
+    results = {}
+    with searched:
+        for name, threshold in thresholds:
+            if name == 'above':
+                hit = searched.first_value_above(threshold, uid)
+            else:
+                hit = searched.first_value_below(threshold, uid)
+            results[name] = hit and hit._asdict()
+            if not as_json:
+                found = 'microtick {}, dot {}'.format(*hit) if hit else 'never'
+                click.echo('value {} {}: {}'.format('>' if name == 'above' else '<', threshold, found))
+
+        if pos is not None:
+            ranges = searched.ticks_on_cell(pos[0], pos[1], start, stop)
+            results['cell'] = ranges
+            if not as_json:
+                click.echo('cell {},{}: {} microticks in {} ranges'.format(
+                    pos[0], pos[1], sum(end - first for first, end in ranges), len(ranges)))
+                for first, end in ranges:
+                    click.echo('{:>9} to {}'.format(first, end - 1))
+
+        if outputs:
+            printed = searched.outputs(start, stop)
+            results['outputs'] = printed
+            if not as_json:
+                for tick, text in printed:
+                    click.echo('{:>9} {}'.format(tick, text.rstrip('\n').replace('\n', '\\n')))
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+
+
 if __name__ == '__main__':
     main()
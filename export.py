@@ -0,0 +1,163 @@
+"""
+Export a recorded trace as a GIF or as PNG images, without display.
+
+The frames are drawn like in the debugger, on offscreen surfaces, by a pool of
+processes that each open the trace (it is memory-mapped, so that's cheap).
+Pillow is needed for the GIFs, the PNGs are saved by pygame.
+"""
+
+import importlib.util
+import multiprocessing
+import os
+from contextlib import contextmanager
+
+DEFAULT_FONT_SIZE = 12
+DEFAULT_FPS = 10
+CHUNK_SIZE = 8  # frames given to a worker at once
+GIF_COLORS = 64  # the code uses a few colors, and some shades for the antialiasing
+WORKER_ENVIRON = {
+    'SDL_VIDEODRIVER': 'dummy',
+    'SDL_NO_SIGNAL_HANDLERS': '1',
+    'PYGAME_HIDE_SUPPORT_PROMPT': '1',
+}
+
+# the renderer of each worker process, made by _init_worker
+_renderer = None  # type: FrameRenderer
+
+
+class FrameRenderer:
+    """Draw the ticks of a trace like the debugger does, on a surface the size of the code."""
+
+    def __init__(self, trace_path, font_size):
+        # imported here, the debugger imports this module
+        import gui
+        from debugger import ReplayRelay
+        from tracefile import MappedTrace
+        from dots.environment import Env
+        from dots.vector import Pos
+        from dots.world import World
+
+        gui.MAINFONT.set_size(font_size)
+        gui.BIGFONT.set_size(font_size * 2)
+        gui.SMALLFONT.set_size(font_size * 0.75)
+
+        self.trace = MappedTrace(trace_path)
+        env = Env()
+        ReplayRelay(env, self.trace)
+        World(env, self.trace.program, self.trace.get_program_dir())
+        # the workers are never closed, the libraries are not needed after the parsing
+        self.trace.remove_program_dir()
+        self.debugger = gui.TraceDebugger(env, False, self.trace)
+
+        # the code, with a line above for the outputs
+        char_width, char_height = gui.MAINFONT.char_size
+        top = gui.BIGFONT.char_size.y
+        width = max(self.debugger.map_tiles.width * char_width, 1)
+        height = self.debugger.map_tiles.height * char_height + top
+        self.debugger.screen = gui.pygame.Surface((width, height))
+        self.debugger.offset = Pos(0, top)
+        self.background = gui.COLORS[gui.BACKGROUND]
+
+    def render(self, tick):
+        """The surface of this tick."""
+        debugger = self.debugger
+        debugger.current_tick = tick
+        debugger.screen.fill(self.background)
+        debugger.render_code(debugger.current_dots)
+        message = debugger.get_current_message()
+        if message:
+            message.render(debugger.screen)
+        return debugger.screen
+
+
+def _init_worker(trace_path, font_size):
+    global _renderer
+    _renderer = FrameRenderer(trace_path, font_size)
+
+
+def _render_png(job):
+    tick, path = job
+    import pygame
+    pygame.image.save(_renderer.render(tick), path)
+    return path
+
+
+def _render_gif_frame(tick):
+    import pygame
+    from PIL import Image
+    surface = _renderer.render(tick)
+    image = Image.frombytes('RGB', surface.get_size(), pygame.image.tostring(surface, 'RGB'))
+    # quantized here, it's the slow part
+    return image.convert('P', palette=Image.ADAPTIVE, colors=GIF_COLORS)
+
+
+def export_trace(trace_path, output, start=0, stop=None, step=1, font_size=DEFAULT_FONT_SIZE,
+                 fps=DEFAULT_FPS, workers=None, progress=None):
+    """
+    Draw the ticks start, start + step, ... until stop of a trace in a GIF or in PNG images.
+
+    Pillow keeps all the frames of a GIF in memory until they are written, so
+    for thousands of frames it's better to export PNG images.
+
+    :param str output: a .gif file, or else a directory where each tick is saved as tick_<tick>.png
+    :param int workers: the number of processes, by default one per core
+    :param progress: called with the number of frames done and the total after each frame
+    :return: the number of frames exported
+    """
+    from tracefile import MappedTrace
+
+    trace = MappedTrace(trace_path)
+    length = len(trace)
+    trace.close()
+    stop = length if stop is None else min(stop, length)
+    ticks = range(max(0, start), stop, step)
+    if not ticks:
+        return 0
+
+    gif = output.lower().endswith('.gif')
+    # optional, the workers import it only when they draw a GIF
+    if gif and importlib.util.find_spec('PIL') is None:
+        raise RuntimeError('Pillow is needed to write GIFs: pip install pillow')
+
+    context = multiprocessing.get_context('spawn')
+    with worker_environ():
+        with context.Pool(workers, _init_worker, (trace_path, font_size)) as pool:
+            if gif:
+                frames = _count(pool.imap(_render_gif_frame, ticks, CHUNK_SIZE), len(ticks), progress)
+                first = next(frames)
+                first.save(output, save_all=True, append_images=frames, duration=1000 // fps, loop=0)
+            else:
+                os.makedirs(output, exist_ok=True)
+                digits = len(str(stop - 1))
+                jobs = [(tick, os.path.join(output, 'tick_{:0{}}.png'.format(tick, digits))) for tick in ticks]
+                for _ in _count(pool.imap_unordered(_render_png, jobs, CHUNK_SIZE), len(jobs), progress):
+                    pass
+
+    return len(ticks)
+
+
+@contextmanager
+def worker_environ():
+    """
+    Set the environment inherited by the workers, and put back the one of the caller after.
+
+    The workers draw without a window, and SDL must not catch the SIGTERM of
+    Pool.terminate(), or the workers never stop.
+    """
+    old = {name: os.environ.get(name) for name in WORKER_ENVIRON}
+    os.environ.update(WORKER_ENVIRON)
+    try:
+        yield
+    finally:
+        for name, value in old.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def _count(items, total, progress):
+    for done, item in enumerate(items, 1):
+        if progress is not None:
+            progress(done, total)
+        yield item
@@ -1,16 +1,22 @@
-import copy
 import os
+import time
+from collections import OrderedDict
 from functools import lru_cache
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 import pygame
 import pygame.gfxdraw
 
-from dots.states import TwoDotState
 from dots.vector import Pos
-from dots.chars import SingletonLibInnerWarpChar
 
+from aggregates import SORT_KEYS, DotAggregates
+from breakpoints import CellBreakpoint, ConditionBreakpoint
+from heatmap import Heatmap, VISITS, WRITES, heat_colors
+from mapmodel import MapModel, load_map_model
+from profiling import Rate, Timings
+from ticks import MAX_HISTORY, STATE_NAMES, Frame, TickStore
 from visual.font import Font
+from visual.viewport import visible_cells
 
 try:
     # fixing f****** dpi awareness of my computer
@@ -20,12 +26,6 @@ try:
 except AttributeError:  # not windows
     pass
 
-Map = List[List["VisualChar"]]
-
-pygame.init()
-pygame.key.set_repeat(200, 10)
-os.environ['SDL_VIDEO_CENTERED'] = '1'
-
 FONTNAME = os.path.join(os.path.dirname(__file__), 'assets', 'monaco.ttf')
 DEFAULT_FONT_SIZE = 24
 MAINFONT = Font(FONTNAME, DEFAULT_FONT_SIZE)
@@ -68,6 +68,34 @@ COLORS = {
 
 MORE_DEBUG = False
 
+
+def open_window(retina):
+    """
+    Open the window, or return the one already open.
+
+    It shows that the program is loading, so the window appears before the
+    program and the map are ready.
+    """
+    screen = pygame.display.get_surface()
+    if screen is not None:
+        return screen
+
+    pygame.init()
+    pygame.key.set_repeat(200, 10)
+    os.environ['SDL_VIDEO_CENTERED'] = '1'
+    if retina:
+        w, h = pygame.display.list_modes()[0]
+        screen = pygame.display.set_mode((w, h), pygame.RESIZABLE)
+    else:
+        screen = pygame.display.set_mode((0, 0), pygame.NOFRAME)
+
+    screen.fill(COLORS[BACKGROUND])
+    loading = BIGFONT.render_text('Loading...', COLORS[MSG])
+    screen.blit(loading, loading.get_rect(center=screen.get_rect().center))
+    pygame.display.update()
+    return screen
+
+
 class Tooltip:
     """Display a list of infos about objects."""
 
@@ -151,13 +179,38 @@ class Message:
         return render(self.text, COLORS[MSG], COLORS[MSG_BG]).convert()
 
 
+def char_color(char, before, after):
+    """Get the colorcode to render a given dots.chars.Char, with the chars before and after it on its line."""
+    if char.isOper():
+        return OPERATOR
+    if char in '[{' and after is not None and after.isOper():
+        return BRACKETS
+    if char in '}]' and before is not None and before.isOper():
+        return BRACKETS
+    if char in '~*':
+        return CONTROL_FLOW
+    if char in '<>v^':
+        return CONTROL_DIR
+    if char.isdigit():
+        return DIGIT
+    if char.isWarp():
+        return WRAP
+    if char.isLibWarp():
+        return LIBVRAP
+    if char in '@#$&':
+        return MODES
+
+    return REGULAR
+
+
 class VisualChar:
-    def __init__(self, char, color):
+    def __init__(self, char, color, class_name):
         self.char = char
         self.color = COLORS[color]
+        self.class_name = class_name  # of the dots.chars.Char in the interpreter
 
     def get_tooltip(self):
-        return MAINFONT.render_text(type(self.char).__name__, COLORS[MOREDEBUG_COLOR])
+        return MAINFONT.render_text(self.class_name, COLORS[MOREDEBUG_COLOR])
 
     def render(self, screen, pos, bg_code):
         # background depends if there is a dot or not
@@ -169,16 +222,16 @@ class VisualChar:
 class Dot:
     """Same as a basic Asciidot dot but with only the nessecary atributes and methods to show it."""
 
-    def __init__(self, dot):
+    def __init__(self, record):
         """
-        :type dot: dots.dot.Dot
+        :type record: ticks.DotRecord
         """
 
-        self.pos = dot.pos
-        self.state = str(dot.state)
-        self.id = dot.id
-        self.value = dot.value
-        self.wait = None if not isinstance(dot.state, TwoDotState) else dot.state.age  # type: int
+        self.pos = record.pos
+        self.state = record.state
+        self.id = record.id
+        self.value = record.value
+        self.wait = record.wait  # type: int
 
     def get_tooltip(self):
         """Get a surface with Display information about the dot value, id and state to the screen."""
@@ -239,37 +292,264 @@ class Dot:
         return MAINFONT.render_text(text, COLORS[MSG])
 
 
+class DotsSummary:
+    """The other dots of a cell, for the tooltip, when there are too many to show them one by one."""
+
+    def __init__(self, count, values):
+        self.count = count
+        self.low = min(values)
+        self.high = max(values)
+
+    def get_tooltip(self):
+        return self._get_tooltip(self.count, self.low, self.high)
+
+    @staticmethod
+    @MAINFONT.clear_when_size_change
+    @lru_cache(8)
+    def _get_tooltip(count, low, high):
+        text = '+{} dots, values {} to {}'.format(count, low, high)
+        return MAINFONT.render_text(text, COLORS[MSG])
+
+
+class Playback:
+    """Advance the time at a given number of ticks per second, whatever the frame rate."""
+
+    MIN_SPEED = 1
+    MAX_SPEED = 2 ** 24
+    DEFAULT_SPEED = 60
+
+    def __init__(self, speed=DEFAULT_SPEED):
+        self.speed = speed  # in ticks per second
+        self.playing = False
+        self._progress = 0.0
+
+    def toggle(self):
+        self.playing = not self.playing
+        self._progress = 0.0
+
+    def faster(self):
+        self.speed = min(self.MAX_SPEED, self.speed * 2)
+
+    def slower(self):
+        self.speed = max(self.MIN_SPEED, self.speed // 2)
+
+    def advance(self, dt):
+        """
+        The number of ticks to move after dt seconds.
+
+        When playing slower than the frame rate, this is 0 for most frames
+        and the fractions of ticks are kept for the next ones.
+        """
+        if not self.playing:
+            return 0
+
+        self._progress += self.speed * dt
+        ticks = int(self._progress)
+        self._progress -= ticks
+        return ticks
+
+    def get_tooltip(self):
+        return SMALLFONT.render_text('{} {} ticks/s'.format('>' if self.playing else '||', self.speed),
+                                     COLORS[MSG], COLORS[MSG_BG])
+
+
+class MapTiles:
+    """
+    The code pre-rendered on tiles of about TILE_PIXELS pixels, rebuilt only when the font size changes.
+
+    Tiles are rendered the first time they are visible and the least recently
+    used are forgotten when they take more than `budget` bytes. The tiles on
+    the screen are never forgotten, even if they alone take more. Between
+    frames, prepare() renders the tiles around the screen, so they are ready
+    when the code is dragged.
+    """
+
+    TILE_PIXELS = 512  # the size of the tiles, so it doesn't grow with the font
+    DEFAULT_BUDGET = 64 * 2 ** 20  # bytes
+    PREPARED_AROUND = 2  # tiles rendered in advance on each side of the screen
+
+    def __init__(self, model, budget=DEFAULT_BUDGET):
+        """
+        :param MapModel model:
+        """
+        self.model = model
+        self.budget = budget
+        self.font_size = None
+        self.tile_cols = self.tile_rows = 1  # the number of chars in a tile
+        self.tiles = OrderedDict()  # type: Dict[Tuple[int, int], pygame.SurfaceType]
+        self.memory = 0
+        self.visible = 0, 0, -1, -1  # the first and last tiles (x, y) on the screen at the last render
+
+        self.width = model.width
+        self.height = model.height
+
+    def render(self, screen, offset):
+        """Draw the tiles visible on the screen, the top left of the code being at offset."""
+        char_width, char_height = MAINFONT.char_size
+        if self.font_size != MAINFONT.font_size:
+            self.clear()
+            self.font_size = MAINFONT.font_size
+            self.tile_cols = max(1, self.TILE_PIXELS // char_width)
+            self.tile_rows = max(1, self.TILE_PIXELS // char_height)
+
+        tile_width = self.tile_cols * char_width
+        tile_height = self.tile_rows * char_height
+        screen_width, screen_height = screen.get_size()
+
+        # the range of the tiles that intersect the screen
+        first_x = max(0, int(-offset[0] // tile_width))
+        first_y = max(0, int(-offset[1] // tile_height))
+        last_x = min((self.width - 1) // self.tile_cols, int((screen_width - offset[0]) // tile_width))
+        last_y = min((self.height - 1) // self.tile_rows, int((screen_height - offset[1]) // tile_height))
+
+        visible = set()
+        for ty in range(first_y, last_y + 1):
+            for tx in range(first_x, last_x + 1):
+                pos = offset[0] + tx * tile_width, offset[1] + ty * tile_height
+                screen.blit(self.get_tile(tx, ty), pos)
+                visible.add((tx, ty))
+
+        self.visible = first_x, first_y, last_x, last_y
+        self.forget(visible)
+
+    def prepare(self):
+        """Render one of the tiles around the screen that are not ready, if they fit in the budget."""
+        if self.font_size != MAINFONT.font_size:
+            return
+        char_width, char_height = MAINFONT.char_size
+        if self.memory + self.tile_cols * char_width * self.tile_rows * char_height * 4 > self.budget:
+            return
+
+        first_x, first_y, last_x, last_y = self.visible
+        for around in range(1, self.PREPARED_AROUND + 1):
+            for ty in range(max(0, first_y - around), min((self.height - 1) // self.tile_rows, last_y + around) + 1):
+                for tx in range(max(0, first_x - around),
+                                min((self.width - 1) // self.tile_cols, last_x + around) + 1):
+                    if (tx, ty) not in self.tiles:
+                        # added as the least recently used, the visible ones stay before it
+                        self.tiles[tx, ty] = tile = self.render_tile(tx, ty)
+                        self.tiles.move_to_end((tx, ty), last=False)
+                        self.memory += self.tile_memory(tile)
+                        return
+
+    def get_tile(self, tx, ty):
+        """The surface of the tile at column tx and row ty of tiles."""
+        key = tx, ty
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        tile = self.render_tile(tx, ty)
+        self.tiles[key] = tile
+        self.memory += self.tile_memory(tile)
+        return tile
+
+    def forget(self, keep):
+        """Forget the tiles not used for the longest time until they fit in the budget, but not the ones in keep."""
+        for key in list(self.tiles):
+            if self.memory <= self.budget:
+                break
+            if key not in keep:
+                self.memory -= self.tile_memory(self.tiles.pop(key))
+
+    def render_tile(self, tx, ty):
+        char_width, char_height = MAINFONT.char_size
+        cols, rows = self.tile_cols, self.tile_rows
+
+        surf = pygame.Surface((cols * char_width, rows * char_height))
+        background = COLORS[BACKGROUND]
+        surf.fill(background)
+        model = self.model
+        for row, line in enumerate(model.lines[ty * rows:(ty + 1) * rows], ty * rows):
+            start = tx * cols
+            for col, char in enumerate(line[start:start + cols], start):
+                if char != ' ':
+                    glyph = MAINFONT.render_char(char, COLORS[model.color(col, row)], background)
+                    surf.blit(glyph, ((col - start) * char_width, (row - ty * rows) * char_height))
+        return surf.convert()
+
+    @staticmethod
+    def tile_memory(tile):
+        return tile.get_width() * tile.get_height() * tile.get_bytesize()
+
+    def clear(self):
+        self.tiles.clear()
+        self.memory = 0
+
+
 class PygameDebugger:
     FPS = 60
-
-    def __init__(self, env, retina):
+    SEARCH_PER_FRAME = 2000
+    HEAT_PER_FRAME = 5000  # ticks of a trace counted in the heatmap at each frame
+    PLAY_WAIT = 0.5  # part of a frame spent waiting for the interpreter when playing faster than it
+    MAX_HISTORY = MAX_HISTORY
+    HUD_PERIOD = 0.25  # seconds between the updates of the performance overlay
+    MAX_DOT_TIPS = 8  # dots under the mouse shown one by one, the others are summed up
+    PANELS = (None, 'dots', 'values', 'cells')  # the aggregated panels, in the order of ctrl + d
+
+    def __init__(self, env, retina, max_history=MAX_HISTORY, started=None):
         """
         Graphical degguer updating from callbacks_relay
 
         :param dots.environemt.Env env:
+        :param int max_history: number of ticks kept in memory, the older ones are computed again when needed
+        :param float started: the time.perf_counter() when the debugger was asked for, now by default
         """
+        self.started = time.perf_counter() if started is None else started
+        self.first_frame = None  # the seconds from started to the first frame on the screen
 
         self.env = env
 
         self.retina = retina
+        # first, so the window shows up while the rest is prepared
+        self.screen = self.get_screen()  # type: pygame.SurfaceType
 
         self.current_tick = -1
-        self.auto_tick = False
-
-        self.ticks = []  # type: List[List[Dot]]
-        self.prints = {}  # type: Dict[int, Message]
-        self.map = self.get_map(self.env)  # type: Map
+        self.playback = Playback()
+        self.searching = None  # the next tick to check when running to a breakpoint
+        self._relay_searching = False
+        self.running = True
+
+        self.ticks = TickStore()
+        self.max_history = max(1, max_history)
+        self._message = None  # type: Message
+        self.show_outputs = False
+        self.outputs_scroll = 0  # number of outputs hidden at the bottom of the panel
+        # the colours, classes and warps of the code, compiled once and cached on disk
+        self.model = load_map_model(self.env.world, char_color)  # type: MapModel
+        # the chars are turned into VisualChar only when they are shown with a dot or hovered
+        self._chars = {}  # type: Dict[Tuple[int, int], VisualChar]
+        self.map_tiles = MapTiles(self.model)
+        # the store gives it the changes as the ticks are recorded
+        self.heatmap = Heatmap(self.map_tiles.width, self.map_tiles.height)
+        self.ticks.observers.append(self.heatmap)
+        self.heat_kind = None  # what the heatmap shows, VISITS or WRITES, or None when hidden
+        self._heat = None, None  # (kind, tick, counted ticks), surface with a pixel per cell
+        # all the dots of the current tick, counted and sorted for the panels
+        self.aggregates = DotAggregates()
+        self.ticks.observers.append(self.aggregates)
+        self.panel = None  # one of PANELS
+        self.panel_scroll = 0  # the first row shown in the panel
+
+        self.timings = Timings()
+        self.show_hud = False
+        self._tick_rate = Rate()
+        self._hud = None  # type: List[pygame.SurfaceType]
+        self._hud_time = 0
 
-        self.screen = self.get_screen()  # type: pygame.SurfaceType
         self.clock = pygame.time.Clock()
 
         self.offset = self.get_default_offset()
+        self.selected = None  # the uid of the dot whose lineage is shown
+        self._selected = None, None  # (uid, length of the history), lineage.DotLineage
+        self._path = None, []  # (uid, segments, last tick), lines of the path
         self.start_drag_pos = None  # type: Pos
         self.start_drag_offset = None  # type: Pos
 
     def get_default_offset(self):
-        width = max(len(line) for line in self.map)
-        height = len(self.map)
+        width = self.model.width
+        height = self.model.height
 
         self.offset = Pos(0, 0)
         width, height = self.map_to_screen_pos(Pos(width, height))
@@ -289,27 +569,21 @@ class PygameDebugger:
 
     def get_screen(self):
         """Get the main screen."""
-        if self.retina:
-            w, h = pygame.display.list_modes()[0]
-            return pygame.display.set_mode((w, h), pygame.RESIZABLE)
-        else:
-            return pygame.display.set_mode((0, 0), pygame.NOFRAME)
-
-    def get_map(self, env):
-        map_ = copy.deepcopy(env.world.map)
-        for row, line in enumerate(map_):
-            for col, char in enumerate(line):
-                color = self.char_to_color(char, Pos(col, row))
-                map_[row][col] = VisualChar(char, color)
-
-        return map_
+        return open_window(self.retina)
 
     def run(self):
-        """Start the debugger. stop it with io.on_finish()"""
-        while not self.env.io.finished:
-            self.update()
-            self.render()
-            pygame.display.update()
+        """Start the debugger. stop it with quit()"""
+        while self.running:
+            with self.timings.measure('update'):
+                self.update()
+            with self.timings.measure('render'):
+                self.render()
+            with self.timings.measure('blit'):
+                pygame.display.update()
+            if self.first_frame is None:
+                self.first_frame = time.perf_counter() - self.started
+            # the tiles around the screen are rendered in advance, one per frame
+            self.map_tiles.prepare()
             self.clock.tick(self.FPS)
 
     def update(self):
@@ -317,17 +591,24 @@ class PygameDebugger:
 
         mouse = Pos(self._get_mouse_pos())
 
-        if self.auto_tick:
-            self.current_tick += 1
-            self.sync_ticks()
+        # we render only the last tick, all the others are just stored
+        ticks = self.playback.advance(self.clock.get_time() / 1000)
+        if ticks:
+            self.current_tick += ticks
+            # the interpreter computes the next frame while this one is shown, and we wait for it a bit
+            self.io.read_ahead(2 * ticks)
+            self.sync_ticks(timeout=self.PLAY_WAIT / self.FPS)
+
+        if self.searching is not None:
+            self.search_breakpoint()
 
         for e in pygame.event.get():
             if e.type == pygame.QUIT:
-                self.io.on_finish()
+                self.quit()
                 return
             elif e.type == pygame.KEYDOWN:
                 if e.key == pygame.K_ESCAPE:
-                    self.io.on_finish()
+                    self.quit()
                     return
                 elif e.key == pygame.K_RIGHT:
                     # move 5 steps if ctrl pressed
@@ -336,16 +617,22 @@ class PygameDebugger:
                 elif e.key == pygame.K_LEFT:
                     self.current_tick = max(-1, self.current_tick -
                                             1 - 4 * (e.mod & pygame.KMOD_CTRL != 0))
+                elif e.key == pygame.K_F5:
+                    self.toggle_search()
+                elif e.key == pygame.K_F3:
+                    self.show_hud = not self.show_hud
+                elif e.key == pygame.K_RIGHTBRACKET:
+                    self.playback.faster()
+                elif e.key == pygame.K_LEFTBRACKET:
+                    self.playback.slower()
                 elif e.key == pygame.K_EQUALS:  # I would like the + but apparently it doesn't work
                     MAINFONT.change_size(1)
                     BIGFONT.set_size(MAINFONT.font_size * 2)
                     SMALLFONT.set_size(MAINFONT.font_size * 0.75)
-                    self.map_to_screen_pos.cache_clear()
                 elif e.key == pygame.K_MINUS:
                     MAINFONT.change_size(-1)
                     BIGFONT.set_size(MAINFONT.font_size * 2)
                     SMALLFONT.set_size(MAINFONT.font_size * 0.75)
-                    self.map_to_screen_pos.cache_clear()
                 elif e.mod & pygame.KMOD_CTRL:
                     if e.key == pygame.K_r:  # reset position and size
                         self.start_drag_pos = None
@@ -353,18 +640,53 @@ class PygameDebugger:
                         MAINFONT.set_size(DEFAULT_FONT_SIZE)
                         BIGFONT.set_size(MAINFONT.font_size * 2)
                         SMALLFONT.set_size(MAINFONT.font_size * 0.75)
-                        self.map_to_screen_pos.cache_clear()
                         self.offset = self.get_default_offset()
                     elif e.key == pygame.K_b:  # go back to the beginning
                         self.current_tick = -1
                     elif e.key == pygame.K_a:  # toggle autotick
-                        self.auto_tick = not self.auto_tick
+                        self.playback.toggle()
                     elif e.key == pygame.K_m:  # toggle more_debug
                         MORE_DEBUG = not MORE_DEBUG
+                    elif e.key == pygame.K_o:  # toggle the panel with all the outputs
+                        self.show_outputs = not self.show_outputs
+                        self.outputs_scroll = 0
+                    elif e.key == pygame.K_h:  # heatmap of the visits, then of the values, then nothing
+                        self.heat_kind = {None: VISITS, VISITS: WRITES, WRITES: None}[self.heat_kind]
+                    elif e.key == pygame.K_d:  # the next panel with all the dots
+                        self.panel = self.PANELS[(self.PANELS.index(self.panel) + 1) % len(self.PANELS)]
+                        self.panel_scroll = 0
+                    elif e.key == pygame.K_s and self.panel == 'dots':  # sort the dots by the next key
+                        aggregates = self.aggregates
+                        aggregates.sort_by(SORT_KEYS[(SORT_KEYS.index(aggregates.sort_key) + 1) % len(SORT_KEYS)])
+                        self.panel_scroll = 0
+                elif self.panel is not None and e.key in (pygame.K_PAGEUP, pygame.K_PAGEDOWN, pygame.K_HOME,
+                                                          pygame.K_END):
+                    page = self.panel_rect().height // SMALLFONT.char_size.y - 1
+                    self.panel_scroll = {pygame.K_PAGEUP: self.panel_scroll - page,
+                                         pygame.K_PAGEDOWN: self.panel_scroll + page,
+                                         pygame.K_HOME: 0,
+                                         pygame.K_END: len(self.aggregates)}[e.key]
+            elif e.type == pygame.MOUSEWHEEL and self.panel is not None and self.panel_rect().collidepoint(mouse):
+                self.panel_scroll -= 3 * e.y
+            elif e.type == pygame.MOUSEWHEEL and self.show_outputs:
+                self.outputs_scroll = max(0, self.outputs_scroll + e.y)
             elif e.type == pygame.MOUSEBUTTONDOWN:
-                self.start_drag_pos = mouse
-                self.start_drag_offset = self.offset
+                if e.button == 1:
+                    self.start_drag_pos = mouse
+                    self.start_drag_offset = self.offset
+                elif e.button == 3:
+                    # a breakpoint on the dot id with shift, on the cell otherwise
+                    dots = self.current_dots
+                    under_mouse = dots.at(self.screen_to_map_pos(mouse))
+                    if pygame.key.get_mods() & pygame.KMOD_SHIFT:
+                        if under_mouse:
+                            self.toggle_breakpoint(ConditionBreakpoint('id', '==', dots.id[under_mouse[0]]))
+                    else:
+                        self.toggle_breakpoint(CellBreakpoint(self.screen_to_map_pos(mouse)))
             elif e.type == pygame.MOUSEBUTTONUP:
+                if e.button == 1 and self.start_drag_pos is not None and self.offset == self.start_drag_offset:
+                    # a click without moving the code
+                    self.select_dot(self.screen_to_map_pos(mouse), pygame.key.get_mods() & pygame.KMOD_CTRL)
                 self.start_drag_pos = None
                 self.start_drag_offset = None
 
@@ -382,111 +704,424 @@ class PygameDebugger:
                 dy = 0
 
             self.offset = self.start_drag_offset + (dx, dy)
-            self.map_to_screen_pos.cache_clear()
 
-        # collect the output
-        if not self.io.outputs.empty():
-            x, _ = Pos(self.screen.get_size())
-            self.prints[self.current_tick] = Message(
-                self.io.outputs.get(), (x, 0), 'topright')
+    def select_dot(self, pos, go_to_birth=False):
+        """Show the lineage of the dot on the cell pos, or nothing if there is none, and maybe go to its birth."""
+        dots = self.current_dots
+        under = dots.at(pos)
+        self.selected = dots.uid[under[0]] if under else None
+        if self.selected is not None and go_to_birth:
+            lineage = self.selected_lineage()
+            if lineage is not None:
+                self.current_tick = lineage.birth
+                self.sync_ticks()
+
+    def selected_lineage(self):
+        """The lineage.DotLineage of the selected dot, or None."""
+        if self.selected is None:
+            return None
+        # the lineage of a trace is read from the file, we read it again only if the history changes
+        key = self.selected, len(self.ticks)
+        if self._selected[0] != key:
+            self._selected = key, self.ticks.lineage.get(self.selected)
+        return self._selected[1]
+
+    def toggle_breakpoint(self, breakpoint):
+        if breakpoint in self.io.breakpoints:
+            self.io.breakpoints.remove(breakpoint)
+        else:
+            self.io.breakpoints.append(breakpoint)
+
+    def toggle_search(self):
+        """Start or stop running to the next breakpoint."""
+        if self.searching is None:
+            self.searching = self.current_tick + 1
+            self._relay_searching = False
+        else:
+            self.searching = None
+            self.io.stop_fast_forward()
+
+    def search_breakpoint(self):
+        """
+        Continue to look for the next breakpoint.
+
+        The ticks already recorded are checked here, a few at each frame so the
+        window stays responsive. After them, the interpreter runs to the
+        breakpoint itself, without giving us the ticks in between. The ticks
+        it computed before are still given and checked here.
+        """
+        self.add_ticks(self.io.get_ticks(self.SEARCH_PER_FRAME))
+
+        hit = self.io.breakpoint_hit if self._relay_searching else None
+        end = min(len(self.ticks), self.searching + self.SEARCH_PER_FRAME)
+        for index in range(self.searching, end):
+            if (hit and self.ticks.microtick(index) == hit[0]) or self.breakpoint_at(index):
+                self.current_tick = index
+                self.searching = None
+                if self._relay_searching and not hit:
+                    self.io.stop_fast_forward()
+                return
+        self.searching = end
+
+        if end == len(self.ticks):
+            if self.io.finished and not self.io.pending:
+                # there was no breakpoint until the end
+                self.current_tick = len(self.ticks) - 1
+                self.searching = None
+            elif not self._relay_searching:
+                # the interpreter can run ahead (a lot in another process), it checks the next ticks itself
+                self.io.run_to_breakpoint()
+                self._relay_searching = True
+
+    def breakpoint_at(self, index):
+        """Whether a breakpoint stops the execution at the recorded tick index."""
+        frame = self.ticks[index]
+        output = self.io.output_log.printed_at(self.ticks.microtick(index))
+        return any(bp.check_frame(frame, output) for bp in self.io.breakpoints)
+
+    def quit(self):
+        """Close the debugger and stop the interpreter."""
+        self.running = False
+        self.io.on_finish()
+
+    def sync_ticks(self, wait=True, timeout=None):
+        """
+        Get new ticks untill current_tick.
 
-    def sync_ticks(self):
-        """Get new ticks untill current_tick."""
-        while self.current_tick >= len(self.ticks) and not self.env.io.finished:
-            tick = self._get_new_tick()
-            self.ticks.append([Dot(dot) for dot in tick])
+        If wait is False, or after timeout seconds, only the ticks already computed
+        are taken and we stay at the last one if the interpreter is late.
+        """
+        if 0 <= self.current_tick < self.ticks.first:
+            self.regenerate()
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        missing = self.current_tick - len(self.ticks) + 1
+        while missing > 0:
+            if deadline is not None:
+                timeout = max(0, deadline - time.perf_counter())
+            ticks = self.io.get_ticks(missing, wait, timeout)
+            if not ticks:
+                # the program is over (or late), we can't go further
+                self.current_tick = len(self.ticks) - 1
+                break
+
+            self.add_ticks(ticks)
+            missing -= len(ticks)
+
+    def add_ticks(self, ticks):
+        """Store new ticks, and forget the oldest ones when there are more than max_history."""
+        for tick in ticks:
+            self.ticks.append(tick)
+
+        # we forget by big chunks, it moves the whole history
+        excess = len(self.ticks) - self.ticks.first - self.max_history
+        if excess > max(self.ticks.keyframe_interval, self.max_history // 8):
+            self.ticks.trim(min(len(self.ticks) - self.max_history, max(self.current_tick, 0)))
+
+    def regenerate(self):
+        """Compute again the forgotten ticks from the last checkpoint before current_tick."""
+        target = self.ticks.microtick(self.current_tick)
+        checkpoint = self.io.restore_before(target)
+        length = self.ticks.index_of(checkpoint)
+
+        self.ticks.truncate(length)
+        # the interpreter now gives all the ticks from the checkpoint, even the ones skipped before
+        self.current_tick = length + target - checkpoint
+        if self.searching is not None:
+            self.searching = None
+            self.io.stop_fast_forward()
 
-    @lru_cache(maxsize=None)
     def map_to_screen_pos(self, pos):
         """Convert the position of char/dot in the map to its coordinates in the screen."""
         return self.offset.x + MAINFONT.char_size.x * pos.col, self.offset.y + MAINFONT.char_size.y * pos.row
 
+    def cell_center(self, pos):
+        """The position on the screen of the center of a cell (col, row)."""
+        char_width, char_height = MAINFONT.char_size
+        x, y = self.map_to_screen_pos(Pos(pos))
+        return x + char_width // 2, y + char_height // 2
+
+    def screen_to_map_pos(self, pos):
+        """Convert a position on the screen to the position of the char under it in the map."""
+        return Pos(int((pos[0] - self.offset.x) // MAINFONT.char_size.x),
+                   int((pos[1] - self.offset.y) // MAINFONT.char_size.y))
+
     def render(self):
         self.screen.fill(COLORS[BACKGROUND])
 
-        if self.current_tick == -1:
-            dot_pos = []
-        else:
-            dot_pos = {dot.pos for dot in self.ticks[self.current_tick]}
+        dots = self.current_dots
 
         mouse = self._get_mouse_pos()
+        mouse_pos = self.screen_to_map_pos(mouse)
         tooltip = Tooltip(mouse + Pos(10, 10))
-        screen_rect = self.screen.get_rect()
 
-        companion = None  # type: Pos
+        self.render_code(dots)
+        self.render_lineage()
 
-        # show every char of the map + dots via the background
-        for row, line in enumerate(self.map):
-            for col, char in enumerate(line):
-                pos = Pos(col, row)
-                pos_on_screen = self.map_to_screen_pos(pos)
-                rect = pygame.Rect(pos_on_screen, MAINFONT.char_size)
-
-                # we don't want to render the char that are outside the screen
-                if not rect.colliderect(screen_rect):
-                    continue
-
-                char.render(self.screen, pos_on_screen, [BACKGROUND, DOT][pos in dot_pos])
-
-                if MORE_DEBUG:
-                    if rect.collidepoint(*mouse):
-                        # show the class of chars
-                        tooltip.add(char)
-                        tooltip.add(Tooltip.separation)
-
-                        # we will draw (later) the connected wrap with an othe background
-                        if char.char.isWarp() and not isinstance(char.char, SingletonLibInnerWarpChar):
-                            companion = char.char.get_dest_loc()
-
-        # redraw the companion char of the current wrap with another bacground
-        if companion:
-            char = self.map[companion.row][companion.col]
-            char.render(self.screen, self.map_to_screen_pos(companion), MOREDEBUG_COLOR)
+        if MORE_DEBUG:
+            char = self.char_at(mouse_pos)
+            if char:
+                # show the class of chars
+                tooltip.add(char)
+                tooltip.add(Tooltip.separation)
+
+                # redraw the companion char of the current wrap with another bacground
+                companion = self.model.warp(mouse_pos)
+                if companion:
+                    self.char_at(companion).render(self.screen, self.map_to_screen_pos(Pos(companion)),
+                                                   MOREDEBUG_COLOR)
 
         # Show output
         current_msg = self.get_current_message()
         if current_msg:
             current_msg.render(self.screen)
-
-        # Tooltips for dot info
-        for dot in self.current_dots:
-            # if there is more than one dot at this place, we want to show only one
-            # the first dot that has this pos
-            if pygame.Rect(self.map_to_screen_pos(dot.pos), MAINFONT.char_size).collidepoint(*mouse):
-                tooltip.add(dot)
+        if self.show_outputs:
+            self.render_outputs(current_msg)
+        if self.panel is not None:
+            self.render_panel()
+
+        # Tooltips for dot info, only the first dots under the mouse are turned into objects
+        under_mouse = dots.at(mouse_pos)
+        for i in under_mouse[:self.MAX_DOT_TIPS]:
+            tooltip.add(Dot(dots.record(i)))
+        if len(under_mouse) > self.MAX_DOT_TIPS:
+            others = under_mouse[self.MAX_DOT_TIPS:]
+            tooltip.add(Tooltip.separation)
+            tooltip.add(DotsSummary(len(others), [dots.value[i] for i in others]))
         # show all the nice tips in last, over everything
         tooltip.render(self.screen)
 
+        if self.searching is not None:
+            status = SMALLFONT.render_text('Running to a breakpoint... {}'.format(self.io.microtick),
+                                           COLORS[MSG], COLORS[MSG_BG])
+        elif self.playback.playing:
+            status = self.playback.get_tooltip()
+        else:
+            status = None
+        if status:
+            self.screen.blit(status, status.get_rect(bottomleft=self.screen.get_rect().bottomleft))
+
+        if self.show_hud:
+            self.render_hud()
+
+    def render_code(self, dots):
+        """Draw the code with the dots of a ticks.Frame on it."""
+        # the code doesn't change, it is drawn once in tiles and we show only the visible ones
+        self.map_tiles.render(self.screen, self.offset)
+        if self.heat_kind is not None:
+            self.render_heatmap()
+
+        # then we draw the chars with a dot over it, with another background. Only the visible ones
+        cells = visible_cells(dots.col, dots.row, self.offset, MAINFONT.char_size, self.screen.get_size())
+        for col, row, x, y in cells:
+            char = self.char_at((col, row))
+            if char:
+                char.render(self.screen, (x, y), DOT)
+
+        if self.panel is not None:
+            # with the panels, the number of dots on the cells that have several
+            for col, row, x, y in cells:
+                count = len(dots.at((col, row)))
+                if count > 1:
+                    badge = SMALLFONT.render_text(str(count), COLORS[MSG], COLORS[CONTROL_FLOW])
+                    self.screen.blit(badge, badge.get_rect(bottomleft=(x + MAINFONT.char_size.x, y + 4)))
+
+        # a frame around the cells with a breakpoint
+        for breakpoint in self.io.breakpoints:
+            if isinstance(breakpoint, CellBreakpoint):
+                rect = pygame.Rect(self.map_to_screen_pos(breakpoint.pos), MAINFONT.char_size)
+                pygame.draw.rect(self.screen, COLORS[CONTROL_FLOW], rect, 1)
+
+    def render_heatmap(self):
+        """Colour the cells by how many dots came on them, or how many values changed on them, until the current tick."""
+        self.count_heat()
+        heatmap = self.heatmap
+        if not heatmap.width or not heatmap.height:
+            return
+
+        key = self.heat_kind, self.current_tick, heatmap.length
+        if self._heat[0] != key:
+            counts = heatmap.at(self.current_tick, self.heat_kind)
+            color = COLORS[CONTROL_FLOW] if self.heat_kind == VISITS else COLORS[DIGIT]
+            pixels = heat_colors(counts, color)
+            surf = pygame.image.frombuffer(pixels, (heatmap.width, heatmap.height), 'RGBA')
+            self._heat = key, (surf, max(counts, default=0), pixels)
+        surf, top, _ = self._heat[1]
+
+        # only the visible cells are scaled, a pixel per cell becomes a char
+        char_width, char_height = MAINFONT.char_size
+        screen_width, screen_height = self.screen.get_size()
+        first_col = max(0, int(-self.offset.x // char_width))
+        first_row = max(0, int(-self.offset.y // char_height))
+        last_col = min(heatmap.width, int((screen_width - self.offset.x) // char_width) + 1)
+        last_row = min(heatmap.height, int((screen_height - self.offset.y) // char_height) + 1)
+        if first_col < last_col and first_row < last_row:
+            cols, rows = last_col - first_col, last_row - first_row
+            visible = surf.subsurface((first_col, first_row, cols, rows))
+            scaled = pygame.transform.scale(visible, (cols * char_width, rows * char_height))
+            self.screen.blit(scaled, self.map_to_screen_pos(Pos(first_col, first_row)))
+
+        what = 'dots came on a cell' if self.heat_kind == VISITS else 'values changed on a cell'
+        text = 'heatmap: at most {} {} (ctrl + h: next)'.format(top, what)
+        info = SMALLFONT.render_text(text, COLORS[MSG], COLORS[MSG_BG])
+        self.screen.blit(info, info.get_rect(midbottom=self.screen.get_rect().midbottom))
+
+    def count_heat(self):
+        """Count the ticks until the current one in the heatmap. Nothing to do, the store gives them as they come."""
+
+    def render_lineage(self):
+        """Draw the path of the selected dot during its whole life, and where it was born."""
+        lineage = self.selected_lineage()
+        if lineage is None:
+            return
+
+        key = lineage.uid, len(lineage), lineage.last
+        if self._path[0] != key:
+            self._path = key, lineage.path()
+
+        for start, end in self._path[1]:
+            pygame.draw.line(self.screen, COLORS[CONTROL_DIR], self.cell_center(start), self.cell_center(end), 2)
+
+        birth = pygame.Rect(self.map_to_screen_pos(Pos(lineage.position(lineage.birth))), MAINFONT.char_size)
+        pygame.draw.rect(self.screen, COLORS[LIBVRAP], birth, 2)
+
+        if lineage.death is None:
+            end = 'alive'
+        else:
+            end = 'dead at step {}'.format(lineage.death)
+        text = 'dot uid {}: born at step {}, {}, {} values (ctrl + click: go to its birth)'.format(
+            lineage.uid, lineage.birth, end, len(lineage.values))
+        info = SMALLFONT.render_text(text, COLORS[MSG], COLORS[MSG_BG])
+        self.screen.blit(info, info.get_rect(bottomright=self.screen.get_rect().bottomright))
+
+    def render_hud(self):
+        """Show the time taken by each phase of the frames, the speed of the interpreter and the memory used."""
+        rate = self._tick_rate.update(self.io.microtick)
+
+        # the text changes at every frame, we render it only a few times per second
+        now = time.perf_counter()
+        if self._hud is None or now - self._hud_time > self.HUD_PERIOD:
+            phases = self.timings.phases
+            total = sum(phase.average for phase in phases.values())
+            lines = ['frame {:.1f} ms  {:.0f} fps'.format(1000 * total, self.clock.get_fps())]
+            if self.first_frame is not None:
+                lines.append('first frame {:.0f} ms after the start'.format(1000 * self.first_frame))
+            lines.append('  '.join('{} {:.1f}'.format(name, 1000 * phase.average) for name, phase in phases.items()))
+            lines.append('{:.0f} microticks/s  {} waiting'.format(rate, self.io.pending))
+            lines.append('history {} ticks  {:.1f} MiB'.format(len(self.ticks) - self.ticks.first,
+                                                             self.ticks.memory() / 2 ** 20))
+            self._hud = [SMALLFONT.render_text(line, COLORS[MSG], COLORS[MSG_BG]) for line in lines]
+            self._hud_time = now
+
+        y = 0
+        for surf in self._hud:
+            self.screen.blit(surf, (0, y))
+            y += surf.get_height()
+
+    def char_at(self, pos):
+        """The VisualChar at this position of the map, or None if there is nothing."""
+        col, row = pos
+        char = self._chars.get((col, row))
+        if char is None:
+            lines = self.model.lines
+            if not (0 <= row < len(lines) and 0 <= col < len(lines[row])):
+                return None
+            char = VisualChar(lines[row][col], self.model.color(col, row), self.model.class_name(col, row))
+            self._chars[col, row] = char
+        return char
+
     def get_current_message(self):
-        ticks = list(
-            filter(lambda x: x <= self.current_tick, self.prints.keys()))
-        if ticks:
-            return self.prints[sorted(ticks)[-1]]
-
-    def char_to_color(self, char, pos):
-        """Get the colorcode to render a given char."""
-        if char.isOper():
-            return OPERATOR
-        if char in '[{' and self.env.world.does_loc_exist(pos + Pos(1, 0)) and self.env.world.get_char_at(
-                        pos + Pos(1, 0)).isOper():
-            return BRACKETS
-        if char in '}]' and self.env.world.does_loc_exist(pos - Pos(1, 0)) and self.env.world.get_char_at(
-                        pos - Pos(1, 0)).isOper():
-            return BRACKETS
-        if char in '~*':
-            return CONTROL_FLOW
-        if char in '<>v^':
-            return CONTROL_DIR
-        if char.isdigit():
-            return DIGIT
-        if char.isWarp():
-            return WRAP
-        if char.isLibWarp():
-            return LIBVRAP
-        if char in '@#$&':
-            return MODES
-
-        return REGULAR
+        """The last output before the current tick, as a Message."""
+        if self.current_tick < 0:
+            return None
+        output = self.io.output_log.at(self.ticks.microtick(self.current_tick))
+        if output is None:
+            return None
+
+        # the message is cached as long as the output is the same
+        if self._message is None or self._message.tick != output[0]:
+            x, _ = Pos(self.screen.get_size())
+            self._message = Message(output[1], (x, 0), 'topright')
+            self._message.tick = output[0]
+        return self._message
+
+    def render_outputs(self, current_msg):
+        """Show the outputs produced until the current tick in a panel, with the microtick of each."""
+        log = self.io.output_log
+        count = log.count_until(self.ticks.microtick(self.current_tick)) if self.current_tick >= 0 else 0
+
+        sw, sh = self.screen.get_size()
+        top = BIGFONT.char_size.y if current_msg else 0
+        rect = pygame.Rect(sw * 2 // 3, top, sw - sw * 2 // 3, sh - top)
+        pygame.gfxdraw.box(self.screen, rect, COLORS[MSG_BG] + (220,))
+
+        # we show only the outputs that fit, the last ones unless we scrolled
+        line_height = SMALLFONT.char_size.y
+        visible = max(1, rect.height // line_height)
+        self.outputs_scroll = min(self.outputs_scroll, max(0, count - visible))
+        last = count - self.outputs_scroll
+
+        y = rect.bottom - line_height
+        for i in range(last - 1, max(0, last - visible) - 1, -1):
+            tick, text = log[i]
+            line = '{:>9} {}'.format(tick, text.rstrip('\n').replace('\n', '\\n'))
+            self.screen.blit(SMALLFONT.render_text(line, COLORS[MSG]), (rect.left + 5, y))
+            y -= line_height
+
+    def panel_rect(self):
+        """Where the panel with all the dots is, on the left third of the screen."""
+        sw, sh = self.screen.get_size()
+        return pygame.Rect(0, 0, sw // 3, sh)
+
+    def render_panel(self):
+        """
+        Show all the dots of the current tick, sorted, or how many have each value, or how many are on each cell.
+
+        Only the rows that fit are rendered, so it doesn't matter if there are thousands.
+        """
+        aggregates = self.aggregates
+        aggregates.move_to(self.ticks, self.current_tick)
+
+        if self.panel == 'dots':
+            title = '{} dots by {} (ctrl + s: sort)'.format(len(aggregates), aggregates.sort_key)
+            header = '{:>7} {:>8} {:>10} {:<12} {}'.format('uid', 'id', 'value', 'state', 'cell')
+            count = len(aggregates)
+
+            def line(i):
+                uid, col, row, id_, value, state, _ = aggregates.row(i)
+                return '{:>7} {:>8} {:>10} {:<12} {},{}'.format(uid, id_, value, STATE_NAMES[state], col, row)
+        elif self.panel == 'values':
+            title = '{} distinct values of {} dots'.format(len(aggregates.distinct), len(aggregates))
+            header = '{:>10} {:>7}'.format('value', 'dots')
+            count = len(aggregates.distinct)
+            top = aggregates.max_count()
+
+            def line(i):
+                value = aggregates.distinct[i]
+                dots = aggregates.values[value]
+                return '{:>10} {:>7} {}'.format(value, dots, '#' * max(1, 20 * dots // top))
+        else:
+            title = '{} cells with dots'.format(len(aggregates.cells))
+            header = '{:>11} {:>7}'.format('cell', 'dots')
+            count = len(aggregates.busiest)
+
+            def line(i):
+                dots, row, col = aggregates.busiest[i]
+                return '{:>11} {:>7}'.format('{},{}'.format(col, row), -dots)
+
+        rect = self.panel_rect()
+        pygame.gfxdraw.box(self.screen, rect, COLORS[MSG_BG] + (220,))
+        line_height = SMALLFONT.char_size.y
+        y = rect.top
+        for text, color in ((title + ' (ctrl + d: next)', COLORS[MODES]), (header, COLORS[OPERATOR])):
+            self.screen.blit(SMALLFONT.render_text(text, color), (rect.left + 5, y))
+            y += line_height
+
+        visible = max(1, (rect.bottom - y) // line_height)
+        self.panel_scroll = max(0, min(self.panel_scroll, count - visible))
+        for i in range(self.panel_scroll, min(count, self.panel_scroll + visible)):
+            self.screen.blit(SMALLFONT.render_text(line(i), COLORS[MSG]), (rect.left + 5, y))
+            y += line_height
 
     def _get_mouse_pos(self):
         x, y = pygame.mouse.get_pos()
@@ -497,18 +1132,42 @@ class PygameDebugger:
 
     @property
     def current_dots(self):
-        """Return a list of the dots in this tick"""
+        """
+        The dots in this tick, stored by columns.
+
+        :rtype: ticks.Frame
+        """
         if self.current_tick == -1:
-            return []
+            return Frame()
         return self.ticks[self.current_tick]
 
-    def _get_new_tick(self):
-        """Get a new tick from the interpreter, it can be none if there is no new tick yet"""
-        return self.env.io.get_tick(wait=True)
-
     @property
     def io(self):
         """
         :rtype: debugger.CallbacksRelay
         """
         return self.env.io
+
+
+class TraceDebugger(PygameDebugger):
+    """Show a recorded trace. All the ticks are available from the start, in any order."""
+
+    def __init__(self, env, retina, trace, started=None):
+        """
+        :param tracefile.MappedTrace trace:
+        """
+        super().__init__(env, retina, started=started)
+        self.ticks = trace
+
+    def sync_ticks(self, wait=True, timeout=None):
+        """Nothing to get, we just stay in the trace."""
+        self.current_tick = min(self.current_tick, len(self.ticks) - 1)
+
+    def add_ticks(self, ticks):
+        """Nothing to add nor to forget, the whole trace stays on disk."""
+
+    def count_heat(self):
+        """The ticks of the trace are counted a few at each frame, until the current one."""
+        heatmap = self.heatmap
+        for tick in range(heatmap.length, min(self.current_tick + 1, heatmap.length + self.HEAT_PER_FRAME)):
+            heatmap.add(tick, *self.ticks.delta(tick))
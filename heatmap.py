@@ -0,0 +1,208 @@
+import math
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+try:
+    # numpy is optional, it colours big maps faster
+    import numpy
+except ImportError:
+    numpy = None
+
+VISITS = 0  # a dot came on the cell
+WRITES = 1  # the value of a dot changed on the cell
+KINDS = (VISITS, WRITES)
+
+
+class Heatmap:
+    """
+    Count, for each cell of the map, the dots that came on it and the values that changed on it.
+
+    The counts are updated as the ticks are recorded, from the changes between
+    ticks. The cells touched at each tick are also logged, and a copy of the
+    counts is kept each time the log grew by as many entries as there are
+    cells, so the counts at any tick are a snapshot plus a part of the log that
+    costs about as much to replay as the copy. When there are more than
+    `max_snapshots`, one out of two is forgotten and the snapshots are twice as
+    far apart. Only the last `max_log` ticks are logged: before, the counts are
+    the ones of the previous snapshot.
+    """
+
+    MIN_SNAPSHOT_ENTRIES = 4096  # for the small maps
+    DEFAULT_MAX_SNAPSHOTS = 32
+    DEFAULT_MAX_LOG = 2 ** 22  # ticks
+
+    def __init__(self, width, height, max_snapshots=DEFAULT_MAX_SNAPSHOTS, max_log=DEFAULT_MAX_LOG):
+        self.width = width
+        self.height = height
+        self.max_snapshots = max(3, max_snapshots)
+        self.max_log = max(2, max_log)
+        # the entries of the log between two snapshots
+        self.snapshot_entries = max(self.MIN_SNAPSHOT_ENTRIES, width * height)
+
+        self.length = 0  # the number of ticks counted
+        self.counts = [array('L', [0]) * (width * height) for _ in KINDS]
+        self._dots = {}  # type: Dict[int, Tuple[int, object]]  # uid -> cell, value
+
+        # the cells touched by each tick, as cell * 2 + kind
+        self.log_first = 0
+        self._log = array('L')
+        self._log_starts = array('Q', [0])
+
+        # the counts of the ticks before each snapshot tick
+        self._snapshot_entries = 0  # the size of the log at the last snapshot
+        self._snapshot_ticks = array('Q', [0])
+        self._snapshots = [[counts[:] for counts in self.counts]]  # type: List[List[array]]
+
+    def add(self, tick, changes, deaths):
+        """
+        Count the next tick of the history.
+
+        :param changes: the ticks.Frame.row_tuple() of the dots new or changed at this tick
+        :param deaths: the uids of the dots that disappeared at this tick
+        """
+        if tick < self.length:
+            # computed again after a restore, it is already counted
+            return
+        self.length = tick + 1
+
+        dots = self._dots
+        for uid in deaths:
+            dots.pop(uid, None)
+
+        visits, writes = self.counts
+        log = self._log
+        for uid, col, row, _, value, _, _ in changes:
+            if not (0 <= col < self.width and 0 <= row < self.height):
+                continue
+            cell = row * self.width + col
+            last = dots.get(uid)
+            if last is None or last[0] != cell:
+                visits[cell] += 1
+                log.append(2 * cell + VISITS)
+            if last is not None and last[1] != value:
+                writes[cell] += 1
+                log.append(2 * cell + WRITES)
+            dots[uid] = cell, value
+        self._log_starts.append(len(log))
+
+        if len(log) - self._snapshot_entries >= self.snapshot_entries:
+            self._snapshot()
+        if self.length - self.log_first > self.max_log:
+            # we forget by big chunks, it moves the whole log
+            self._trim_log(self.length - self.max_log // 2)
+
+    def truncate(self, length, dots):
+        """
+        Forget the ticks from length onwards, they are counted again with add().
+
+        :param dots: the ticks.Frame.row_tuple() of the dots alive at the tick before length, by uid
+        """
+        if length >= self.length:
+            return
+        self.counts = [self.at(length - 1, kind)[:] for kind in KINDS]
+        self._dots = {uid: (row * self.width + col, value) for uid, col, row, _, value, _, _ in dots.values()
+                      if 0 <= col < self.width and 0 <= row < self.height}
+
+        # a snapshot at length counts the ticks before, it stays right
+        i = bisect_right(self._snapshot_ticks, length)
+        del self._snapshot_ticks[i:]
+        del self._snapshots[i:]
+
+        if length >= self.log_first:
+            count = length - self.log_first
+            del self._log[self._log_starts[count]:]
+            del self._log_starts[count + 1:]
+        else:
+            self._log = array('L')
+            self._log_starts = array('Q', [0])
+            self.log_first = length
+        last = self._snapshot_ticks[-1] - self.log_first
+        self._snapshot_entries = self._log_starts[last] if last >= 0 else 0
+        self.length = length
+
+    def at(self, tick, kind=VISITS):
+        """The counts of one kind of all the cells, for the ticks until tick included."""
+        length = min(tick + 1, self.length)
+        if length == self.length:
+            return self.counts[kind]
+
+        # the last snapshot from where the log goes until the tick
+        i = bisect_right(self._snapshot_ticks, length) - 1
+        start = self._snapshot_ticks[i]
+        counts = self._snapshots[i][kind][:]
+        if start < self.log_first:
+            return counts
+
+        entries = self._log[self._log_starts[start - self.log_first]:self._log_starts[length - self.log_first]]
+        if numpy is not None:
+            entries = numpy.frombuffer(entries, dtype=_dtype(entries))
+            added = numpy.bincount(entries[entries & 1 == kind] >> 1, minlength=len(counts))
+            total = numpy.frombuffer(counts, dtype=_dtype(counts)) + added
+            return array(counts.typecode, total.astype(_dtype(counts)).tobytes())
+
+        for entry in entries:
+            if entry & 1 == kind:
+                counts[entry >> 1] += 1
+        return counts
+
+    def _snapshot(self):
+        self._snapshot_entries = len(self._log)
+        self._snapshot_ticks.append(self.length)
+        self._snapshots.append([counts[:] for counts in self.counts])
+        self._thin()
+
+    def _thin(self):
+        """Forget one snapshot out of two if there are too many."""
+        if len(self._snapshots) <= self.max_snapshots:
+            return
+        # the first and last snapshots and the one at the start of the log are always kept
+        self.snapshot_entries *= 2
+        last = len(self._snapshots) - 1
+        keep = [i for i, tick in enumerate(self._snapshot_ticks)
+                if i % 2 == 0 or i == last or tick == self.log_first]
+        self._snapshot_ticks = array('Q', (self._snapshot_ticks[i] for i in keep))
+        self._snapshots = [self._snapshots[i] for i in keep]
+
+    def _trim_log(self, first):
+        """Forget the log of the ticks before first, with a snapshot at first so the counts after stay exact."""
+        if first not in self._snapshot_ticks:
+            counts = [self.at(first - 1, kind) for kind in KINDS]
+            i = bisect_right(self._snapshot_ticks, first)
+            self._snapshot_ticks.insert(i, first)
+            self._snapshots.insert(i, counts)
+
+        count = first - self.log_first
+        start = self._log_starts[count]
+        self._snapshot_entries = max(0, self._snapshot_entries - start)
+        del self._log[:start]
+        self._log_starts = array('Q', (offset - start for offset in self._log_starts[count:]))
+        self.log_first = first
+        self._thin()
+
+
+def heat_colors(counts, color, max_alpha=180):
+    """
+    The RGBA bytes of an image with one pixel per cell, more opaque on the cells with bigger counts.
+
+    The opacity grows with the log of the count, so a few cells counted a lot
+    don't hide all the others.
+    """
+    top = max(counts, default=0)
+    pixels = bytearray(bytes(color) + b'\0') * len(counts)
+    if not top:
+        return pixels
+
+    scale = max_alpha / math.log1p(top)
+    if numpy is not None:
+        alphas = numpy.log1p(numpy.frombuffer(counts, dtype=_dtype(counts))) * scale
+        pixels[3::4] = alphas.astype(numpy.uint8).tobytes()
+    else:
+        log1p = math.log1p
+        pixels[3::4] = bytes(int(log1p(count) * scale) for count in counts)
+    return pixels
+
+
+def _dtype(unsigned):
+    """The numpy type of the items of an array of unsigned integers."""
+    return 'u%d' % unsigned.itemsize
@@ -0,0 +1,171 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict
+
+
+class DotLineage:
+    """
+    The whole life of one dot: its birth, its path and its values, until its death.
+
+    The path is made of segments where the dot moves by the same step at each
+    tick (a step of zero while it waits), so a dot going straight on a long line
+    takes as much room as a dot that moves once. All the ticks are indices in
+    the history of the execution.
+    """
+
+    __slots__ = ('uid', 'birth', 'death', 'last', 'starts', 'moves', 'value_ticks', 'values')
+
+    def __init__(self, uid, birth, col, row, value):
+        self.uid = uid
+        self.birth = birth
+        self.death = None  # the first tick without the dot
+        self.last = birth  # the last tick where the dot changed
+        self.starts = array('q', [birth])  # the first tick of each segment
+        self.moves = array('q', [col, row, 0, 0])  # col, row, step col, step row of each segment
+        self.value_ticks = array('q', [birth])  # the ticks where the value changed
+        self.values = [value]
+
+    def __len__(self):
+        """The number of segments of the path."""
+        return len(self.starts)
+
+    def position(self, tick):
+        """The (col, row) of the dot at this tick, that must be in its life."""
+        segment = bisect_right(self.starts, tick) - 1
+        if segment == len(self.starts) - 1:
+            # the dot didn't change after the last tick seen
+            tick = min(tick, self.last)
+        return self._position(segment, tick)
+
+    def value(self, tick):
+        """The value of the dot at this tick."""
+        return self.values[max(0, bisect_right(self.value_ticks, tick) - 1)]
+
+    def segment(self, i):
+        """The segment i, as (start tick, col, row, step col, step row)."""
+        return (self.starts[i],) + tuple(self.moves[4 * i:4 * i + 4])
+
+    def path(self):
+        """
+        The straight lines followed by the dot, as ((col, row), (col, row)) without repetition.
+
+        The jumps of the warps are not lines, they are left out.
+        """
+        lines = {}  # an ordered set
+        previous = None
+        for i in range(len(self.starts)):
+            start, col, row, step_col, step_row = self.segment(i)
+            end = self.starts[i + 1] - 1 if i + 1 < len(self.starts) else self.last
+            if previous is not None and _adjacent(previous, (col, row)):
+                lines[previous, (col, row)] = None
+            previous = self._position(i, end)
+            if abs(step_col) <= 1 and abs(step_row) <= 1:
+                lines[(col, row), previous] = None
+        return [line for line in lines if line[0] != line[1]]
+
+    def _position(self, segment, tick):
+        col, row, step_col, step_row = self.moves[4 * segment:4 * segment + 4]
+        age = tick - self.starts[segment]
+        return col + step_col * age, row + step_row * age
+
+    def change(self, tick, col, row, value):
+        """The dot changed at this tick, after all the ticks already given."""
+        segment = len(self.starts) - 1
+        step_col, step_row = self.moves[-2:]
+        if self.last < tick - 1 and (step_col or step_row):
+            # the dot didn't change, so didn't move, since the last time we saw it
+            self._add_segment(self.last + 1, self._position(segment, self.last), (0, 0))
+            segment += 1
+
+        if self._position(segment, tick) != (col, row):
+            # we guess it continues in the same direction, until it doesn't
+            before = self._position(segment, tick - 1)
+            self._add_segment(tick, (col, row), (col - before[0], row - before[1]))
+
+        if value != self.values[-1]:
+            self.value_ticks.append(tick)
+            self.values.append(value)
+        self.last = tick
+
+    def truncate(self, length):
+        """Forget what happened from the tick length onwards, after the birth."""
+        segments = bisect_left(self.starts, length)
+        del self.starts[segments:]
+        del self.moves[4 * segments:]
+        values = bisect_left(self.value_ticks, length)
+        del self.value_ticks[values:]
+        del self.values[values:]
+        # the dot moved at each tick of a segment with a step, so it is still where the segment says
+        self.last = min(self.last, length - 1)
+        if self.death is not None and self.death >= length:
+            self.death = None
+
+    def _add_segment(self, tick, pos, step):
+        self.starts.append(tick)
+        self.moves.extend((pos[0], pos[1], step[0], step[1]))
+
+
+def _adjacent(a, b):
+    return abs(a[0] - b[0]) <= 1 and abs(a[1] - b[1]) <= 1
+
+
+class Lineage:
+    """
+    The DotLineage of every dot of an execution, indexed by uid.
+
+    It is built while the ticks are recorded, from the changes between ticks, so
+    the cost is proportional to the dots that change. The ticks already seen
+    are ignored: after a restore, the interpreter gives the same ticks again,
+    unless they were truncate()d because they are numbered differently.
+    """
+
+    def __init__(self):
+        self.dots = {}  # type: Dict[int, DotLineage]
+        self.length = 0  # the number of ticks seen
+
+    def __len__(self):
+        return len(self.dots)
+
+    def get(self, uid):
+        """The DotLineage of a dot, or None if it was never seen."""
+        return self.dots.get(uid)
+
+    def add(self, tick, changes, deaths):
+        """
+        Add the next tick of the history.
+
+        :param changes: the ticks.Frame.row_tuple() of the dots new or changed at this tick
+        :param deaths: the uids of the dots that disappeared at this tick
+        """
+        if tick < self.length:
+            return
+        self.length = tick + 1
+
+        dots = self.dots
+        for uid in deaths:
+            dots[uid].death = tick
+        for uid, col, row, _, value, _, _ in changes:
+            dot = dots.get(uid)
+            if dot is None:
+                dots[uid] = DotLineage(uid, tick, col, row, value)
+            else:
+                dot.change(tick, col, row, value)
+
+    def truncate(self, length, dots=None):
+        """Forget the ticks from length onwards, they are given again with add()."""
+        if length >= self.length:
+            return
+        for uid, dot in list(self.dots.items()):
+            if dot.birth >= length:
+                del self.dots[uid]
+            else:
+                dot.truncate(length)
+        self.length = length
+
+    @classmethod
+    def from_history(cls, history):
+        """Build the lineage of a ticks.TickHistory by going through all its ticks."""
+        lineage = cls()
+        for tick in range(history.first, len(history)):
+            lineage.add(tick, *history.delta(tick))
+        return lineage
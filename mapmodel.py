@@ -0,0 +1,175 @@
+"""
+The map of a program compiled once for the display: its chars, their colour and class, and where the warps lead.
+
+Compiling it goes through every char of the world, so the result is saved in
+a cache directory under the hash of the code, libraries included. The next
+time the same code is opened, the file is only read.
+"""
+
+import hashlib
+import os
+import struct
+from array import array
+from typing import Dict, List, Tuple
+
+VERSION = 1  # to change with the colours of gui.char_color(), the cached maps are then compiled again
+MAGIC = b'DOTSMAP' + bytes([VERSION])
+
+_HEAD = struct.Struct('<IIQQQ')  # width, height, size of the text, of the class names and of the warps
+NO_CHAR = 255  # the colour of the cells after the end of their line
+
+
+def cache_dir():
+    """The directory where the compiled maps are kept."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'asciidots-debugger')
+
+
+class MapModel:
+    """
+    The chars of the map with, in flat arrays of width x height cells, their colour code and class.
+
+    The warps are indexed by their position, with the position where they send
+    the dots. Only the warps with one destination are there, the ones that
+    return from a library depend on where the dot came from.
+    """
+
+    def __init__(self, lines, colors, classes, class_names, warps):
+        """
+        :param List[str] lines: the text of each row of the map
+        :param array colors: the colour code of each cell, NO_CHAR after the end of a line
+        :param array classes: the index in class_names of the class of the char of each cell
+        :param List[str] class_names: the names of the dots.chars classes
+        :param Dict[Tuple[int, int], Tuple[int, int]] warps: (col, row) of a warp -> (col, row) of its destination
+        """
+        self.lines = lines
+        self.width = max((len(line) for line in lines), default=0)
+        self.height = len(lines)
+        self.colors = colors
+        self.classes = classes
+        self.class_names = class_names
+        self.warps = warps
+
+    def color(self, col, row):
+        return self.colors[row * self.width + col]
+
+    def class_name(self, col, row):
+        return self.class_names[self.classes[row * self.width + col]]
+
+    def warp(self, pos):
+        """The (col, row) where the warp at pos leads, or None if there is no warp or it has no fixed destination."""
+        return self.warps.get(tuple(pos))
+
+    @classmethod
+    def compile(cls, world, color):
+        """
+        Go once through all the chars of a dots.world.World.
+
+        :param color: gives the colour code of a dots.chars.Char from it and the
+            chars before and after it on its line (None at the ends)
+        """
+        from dots.chars import LibInnerWarpChar
+
+        lines = [''.join(line) for line in world.map]
+        width = max((len(line) for line in lines), default=0)
+        colors = array('B', [NO_CHAR]) * (width * len(lines))
+        classes = array('B', [0]) * (width * len(lines))
+        class_names = []  # type: List[str]
+        class_index = {}  # type: Dict[type, int]
+        warps = {}
+
+        for row, line in enumerate(world.map):
+            start = row * width
+            for col, char in enumerate(line):
+                before = line[col - 1] if col > 0 else None
+                after = line[col + 1] if col + 1 < len(line) else None
+                colors[start + col] = color(char, before, after)
+
+                kind = type(char)
+                if kind not in class_index:
+                    class_index[kind] = len(class_names)
+                    class_names.append(kind.__name__)
+                classes[start + col] = class_index[kind]
+
+                # the inner warps of the libraries go back to where the dot entered
+                if char.isWarp() and not isinstance(char, LibInnerWarpChar):
+                    dest = char.get_dest_loc()
+                    if dest is not None:
+                        warps[col, row] = dest.col, dest.row
+
+        return cls(lines, colors, classes, class_names, warps)
+
+    def to_bytes(self):
+        text = '\n'.join(self.lines).encode()
+        names = '\n'.join(self.class_names).encode()
+        warps = array('I')
+        for pos, dest in self.warps.items():
+            warps.extend(pos + dest)
+        warps = warps.tobytes()
+        return b''.join((MAGIC, _HEAD.pack(self.width, self.height, len(text), len(names), len(warps)),
+                         text, names, self.colors.tobytes(), self.classes.tobytes(), warps))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Read a model saved by to_bytes(). Raise ValueError if it's not one."""
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a compiled map of version {}'.format(VERSION))
+        try:
+            width, height, text_size, names_size, warps_size = _HEAD.unpack_from(data, len(MAGIC))
+        except struct.error:
+            raise ValueError('truncated compiled map')
+        offset = len(MAGIC) + _HEAD.size
+
+        def take(size):
+            nonlocal offset
+            part = data[offset:offset + size]
+            if len(part) != size:
+                raise ValueError('truncated compiled map')
+            offset += size
+            return part
+
+        lines = take(text_size).decode().split('\n') if height else []
+        class_names = take(names_size).decode().split('\n') if names_size else []
+        colors = array('B', take(width * height))
+        classes = array('B', take(width * height))
+        flat = array('I')
+        flat.frombytes(take(warps_size))
+        warps = {(flat[i], flat[i + 1]): (flat[i + 2], flat[i + 3]) for i in range(0, len(flat), 4)}
+        return cls(lines, colors, classes, class_names, warps)
+
+
+def map_key(world):
+    """The hash of the code of a dots.world.World, libraries included."""
+    digest = hashlib.sha256(MAGIC)
+    for line in world.map:
+        digest.update(''.join(line).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def load_map_model(world, color, directory=None):
+    """
+    The MapModel of a dots.world.World, from the cache if the same code was already compiled.
+
+    :param color: see MapModel.compile()
+    :param str directory: where the models are cached, cache_dir() by default
+    """
+    path = os.path.join(directory or cache_dir(), map_key(world) + '.map')
+    try:
+        with open(path, 'rb') as f:
+            return MapModel.from_bytes(f.read())
+    except (OSError, ValueError):
+        pass
+
+    model = MapModel.compile(world, color)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written aside and renamed, so another debugger never reads half a file
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(model.to_bytes())
+        os.replace(temp, path)
+    except OSError:
+        # without cache, it will be compiled again next time
+        pass
+    return model
@@ -0,0 +1,54 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class OutputLog:
+    """
+    All the outputs of an execution, with the microtick that produced each.
+
+    The outputs are sorted by microtick, so the ones visible at a given tick
+    are found by bisection. The interpreter adds them while the gui reads them.
+    """
+
+    def __init__(self):
+        self.ticks = array('Q')
+        self.texts = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def __getitem__(self, i):
+        """The output i, as (tick, text)."""
+        with self._lock:
+            return self.ticks[i], self.texts[i]
+
+    def add(self, tick, text):
+        """Add an output, produced by a microtick after all the others."""
+        with self._lock:
+            self.ticks.append(tick)
+            self.texts.append(str(text))
+
+    def count_until(self, tick):
+        """The number of outputs produced at or before the microtick."""
+        return bisect_right(self.ticks, tick)
+
+    def printed_at(self, tick):
+        """Whether the microtick printed something."""
+        with self._lock:
+            i = bisect_left(self.ticks, tick)
+            return i < len(self.ticks) and self.ticks[i] == tick
+
+    def at(self, tick):
+        """The last output produced at or before the microtick, as (tick, text), or None."""
+        with self._lock:
+            i = bisect_right(self.ticks, tick) - 1
+            return (self.ticks[i], self.texts[i]) if i >= 0 else None
+
+    def truncate(self, tick):
+        """Forget the outputs produced from the microtick onwards."""
+        with self._lock:
+            i = bisect_left(self.ticks, tick)
+            del self.ticks[i:]
+            del self.texts[i:]
@@ -0,0 +1,236 @@
+"""
+Run the interpreter in a child process, so it doesn't share the GIL with the display.
+
+The child runs the usual CallbacksRelay and copies its ticks, encoded like in
+the trace files, into a ring buffer in shared memory. The ProcessRelay in the
+debugger reads them from there and has the same interface as CallbacksRelay.
+The commands (breakpoints, restores, quit) go to the child through a pipe.
+"""
+
+import multiprocessing
+import queue
+import struct
+import time
+from collections import deque
+from typing import List, Tuple
+
+import breakpoints
+from outputs import OutputLog
+from ringbuffer import RingBuffer, RingClosed
+from ticks import TickDelta, diff, rows_by_uid
+from tracefile import END, KEYFRAME, OUTPUT, TICK, pack_tick, unpack_tick
+from dots.callbacks import IOCallbacksStorage
+
+HIT = b'H'
+
+# every record starts with the microtick and the number of restores done before it
+_INFO = struct.Struct('<QI')
+_HIT_INDEX = struct.Struct('<I')
+
+DEFAULT_CAPACITY = 32 * 2 ** 20  # bytes
+BATCH = 256  # ticks taken from the interpreter at once
+
+# user slots of the ring header
+_MICROTICK = 0
+
+
+class ProcessRelay(IOCallbacksStorage):
+    """Stands for the interpreter that runs in a child process."""
+
+    def __init__(self, env, program, program_dir, prefetch, capacity=DEFAULT_CAPACITY):
+        super().__init__(env)
+
+        self.errors = queue.Queue()
+        self.output_log = OutputLog()
+        self.breakpoints = []  # type: List[breakpoints.Breakpoint]
+        self.fast_forward = False
+        self.breakpoint_hit = None  # type: Tuple[int, breakpoints.Breakpoint]
+        self.finished = False
+
+        self._frames = deque()
+        self._generation = 0  # the number of restores, the records before the last one are dropped
+        self._searched = []  # the breakpoints given to the child for the last run_to_breakpoint
+        self._records_read = 0
+
+        context = multiprocessing.get_context('spawn')
+        memory, condition = RingBuffer.allocate(context, capacity)
+        self._ring = RingBuffer(memory, condition)
+        self._connection, child_connection = context.Pipe()
+        self.process = context.Process(target=serve, daemon=True,
+                                       args=(program, program_dir, memory, condition, child_connection, prefetch))
+        self.process.start()
+
+    @property
+    def microtick(self):
+        """The number of microticks computed by the child."""
+        return self._ring.get_user(_MICROTICK)
+
+    @property
+    def pending(self):
+        """Number of ticks (and outputs) computed but not yet taken."""
+        return len(self._frames) + self._ring.records_written - self._records_read
+
+    def get_ticks(self, count, wait=False, timeout=None):
+        """Same as CallbacksRelay.get_ticks(), but the ticks are TickDeltas, to add to a TickStore."""
+        # the records are decoded only when the ticks are needed
+        while len(self._frames) < count and self._read(count - len(self._frames)):
+            pass
+
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while wait and not self._frames and not self.finished:
+            left = 0.1 if deadline is None else min(0.1, deadline - time.perf_counter())
+            if left <= 0:
+                break
+            if not self._read(count, timeout=left) and not self.process.is_alive():
+                self.finished = True
+
+        count = min(count, len(self._frames))
+        return [self._frames.popleft() for _ in range(count)]
+
+    def read_ahead(self, count):
+        """The child already runs ahead as far as the ring buffer allows."""
+
+    def _read(self, max_records=None, timeout=None):
+        """Decode the records written by the child. Returns the number of records read."""
+        records = self._ring.read(max_records, timeout)
+        for tag, payload in records:
+            tick, generation = _INFO.unpack_from(payload)
+            if generation != self._generation:
+                # computed before the last restore
+                continue
+
+            if tag == TICK or tag == KEYFRAME:
+                # the ticks stay deltas, the history builds the frames only when they are shown
+                changes, deaths = unpack_tick(payload, _INFO.size)
+                if tag == KEYFRAME:
+                    # the outputs after this keyframe will be computed again
+                    self.output_log.truncate(tick + 1)
+                self._frames.append(TickDelta(tick, changes, deaths, tag == KEYFRAME))
+            elif tag == OUTPUT:
+                self.output_log.add(tick, bytes(payload[_INFO.size:]).decode())
+            elif tag == HIT:
+                index, = _HIT_INDEX.unpack_from(payload, _INFO.size)
+                self.breakpoint_hit = tick, self._searched[index]
+                self.fast_forward = False
+            elif tag == END:
+                self.finished = True
+
+        self._records_read += len(records)
+        self._ring.release()
+        return len(records)
+
+    def run_to_breakpoint(self):
+        self.breakpoint_hit = None
+        self.fast_forward = True
+        self._searched = list(self.breakpoints)
+        self._connection.send(('run_to_breakpoint', self._searched))
+
+    def stop_fast_forward(self):
+        self.fast_forward = False
+        self._connection.send(('stop_fast_forward',))
+
+    def restore_before(self, tick):
+        """Same as CallbacksRelay.restore_before()."""
+        self._generation += 1
+        self._frames.clear()
+        self.fast_forward = False
+        self.breakpoint_hit = None
+        self.finished = False
+        self._connection.send(('restore', tick, self._generation))
+
+        # the child may be waiting for room in the ring to write old ticks before it reads the command
+        while not self._connection.poll(0.01):
+            self._read()
+        return self._connection.recv()
+
+    def on_finish(self):
+        """Stop the child."""
+        self.finished = True
+        self._ring.close()
+        try:
+            self._connection.send(('quit',))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def serve(program, program_dir, memory, condition, connection, prefetch):
+    """Run the program in this process and copy its ticks in the ring, until the debugger quits."""
+    # imported here, the debugger imports this module
+    from debugger import CallbacksRelay
+    from dots.environment import Env
+    from dots.interpreter import AsciiDotsInterpreter
+
+    env = Env()
+    relay = CallbacksRelay(env, prefetch)
+    ring = RingBuffer(memory, condition)
+
+    interpreter = AsciiDotsInterpreter(env, program, program_dir, True)
+    interpreter.run(run_in_separate_thread=True, make_thread_daemon=True)
+
+    generation = 0
+    last = None  # the rows of the last tick written, None to write a keyframe
+    restored = None  # the tick of the checkpoint restored, until its tick is taken
+    sent = 0  # the number of outputs of the log already written
+    end_written = False
+    info = _INFO.pack
+
+    try:
+        while True:
+            while connection.poll():
+                command, *args = connection.recv()
+                if command == 'quit':
+                    return
+                elif command == 'run_to_breakpoint':
+                    relay.breakpoints[:] = args[0]
+                    relay.run_to_breakpoint()
+                elif command == 'stop_fast_forward':
+                    relay.stop_fast_forward()
+                elif command == 'restore':
+                    tick, generation = args
+                    checkpoint = relay.checkpoints.before(tick)
+                    connection.send(checkpoint.tick)
+                    relay.restore(checkpoint)
+                    last = None
+                    restored = checkpoint.tick
+                    end_written = False
+
+            log = relay.output_log
+            while sent < len(log):
+                tick, text = log[sent]
+                ring.write(OUTPUT, info(tick, generation), str(text).encode())
+                sent += 1
+
+            frames = relay.get_ticks(BATCH)
+            for frame in frames:
+                if restored is not None:
+                    # the outputs after the checkpoint were forgotten by the relay, and will be sent again
+                    sent = min(sent, log.count_until(restored))
+                    restored = None
+
+                current = rows_by_uid(frame)
+                if last is None:
+                    ring.write(KEYFRAME, info(frame.tick, generation), pack_tick(list(current.values()), ()))
+                else:
+                    ring.write(TICK, info(frame.tick, generation), pack_tick(*diff(last, current)))
+                last = current
+
+                hit = relay.breakpoint_hit
+                if hit is not None and hit[0] == frame.tick and hit[1] in relay.breakpoints:
+                    ring.write(HIT, info(frame.tick, generation), _HIT_INDEX.pack(relay.breakpoints.index(hit[1])))
+
+            if relay.finished and not frames and not relay.pending and sent == len(log) and not end_written:
+                ring.write(END, info(relay.microtick, generation))
+                end_written = True
+
+            ring.set_user(_MICROTICK, relay.microtick)
+            ring.flush()
+            if not frames:
+                # nothing to do, we wait for the interpreter or a command
+                connection.poll(0.005)
+    except (RingClosed, EOFError, BrokenPipeError):
+        pass
+    finally:
+        relay.on_finish()
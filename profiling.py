@@ -0,0 +1,100 @@
+import cProfile
+import io
+import pstats
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Phase:
+    """The timings of one phase of the frames."""
+
+    SMOOTHING = 0.05  # weight of the last frame in the average shown
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.average = 0.0
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+        self.last = duration
+        if self.count == 1:
+            self.average = duration
+        else:
+            self.average += (duration - self.average) * self.SMOOTHING
+
+
+class Timings:
+    """Measure how long each phase of the frames takes."""
+
+    def __init__(self):
+        self.phases = OrderedDict()  # type: Dict[str, Phase]
+
+    @contextmanager
+    def measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, duration):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase()
+        phase.add(duration)
+
+    def report(self):
+        """A table with the number of frames, the total, mean and max time of each phase."""
+        lines = ['{:<10} {:>8} {:>10} {:>10} {:>10}'.format('phase', 'count', 'total s', 'mean ms', 'max ms')]
+        for name, phase in self.phases.items():
+            lines.append('{:<10} {:>8} {:>10.3f} {:>10.3f} {:>10.3f}'.format(
+                name, phase.count, phase.total, 1000 * phase.total / max(1, phase.count), 1000 * phase.max))
+        return '\n'.join(lines)
+
+
+class Rate:
+    """The rate of a counter that grows, like the microticks computed, averaged over `period` seconds."""
+
+    def __init__(self, period=0.5):
+        self.period = period
+        self.rate = 0.0
+        self._time = None
+        self._value = 0
+
+    def update(self, value):
+        now = time.perf_counter()
+        if self._time is None or value < self._value:
+            # the first value, or the counter went back (the interpreter restored a checkpoint)
+            self._time, self._value = now, value
+        elif now - self._time >= self.period:
+            self.rate = (value - self._value) / (now - self._time)
+            self._time, self._value = now, value
+        return self.rate
+
+
+def profile_call(func, timings=None, limit=30):
+    """
+    Call func with cProfile, then give the timings of the phases and the most expensive functions.
+
+    Only the calls on this thread are profiled, not the interpreter running on
+    another thread or process.
+    :return: the text of the report
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        func()
+    finally:
+        profiler.disable()
+
+    out = io.StringIO()
+    if timings is not None:
+        out.write(timings.report() + '\n\n')
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
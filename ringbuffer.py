@@ -0,0 +1,165 @@
+import struct
+
+_RECORD_HEAD = struct.Struct('<cI')  # tag, length of the payload
+PAD = b'P'  # the rest of the buffer is empty, the next record is at the start
+
+# the counters at the start of the shared memory, as uint64
+_WRITE_POS = 0
+_READ_POS = 1
+_RECORDS_WRITTEN = 2
+_CLOSED = 3
+_USER = 4  # free for the users of the ring
+_HEADER_SLOTS = 8
+_HEADER_SIZE = 8 * _HEADER_SLOTS
+
+
+class RingClosed(Exception):
+    """The other side closed the ring."""
+
+
+class RingBuffer:
+    """
+    A ring buffer of records in shared memory, between one writer and one reader.
+
+    Records are a tag, the length of the payload and the payload, like in the
+    trace files. They are never cut by the end of the buffer: a PAD record sends
+    the reader back to the start. The positions only grow, the offset in the
+    buffer being the position modulo the capacity.
+
+    The positions are shared through a header, updated under a lock shared by
+    both processes, with the condition used to wait for room or for records.
+    Records are written and read in batches, so the lock is not taken for each.
+    """
+
+    def __init__(self, memory, condition):
+        """
+        :param memory: a shared buffer, from multiprocessing.RawArray('B', size)
+        :param condition: a multiprocessing.Condition shared by both sides
+        """
+        view = memoryview(memory).cast('B')
+        self.header = view[:_HEADER_SIZE].cast('Q')
+        self.data = view[_HEADER_SIZE:]
+        self.capacity = len(self.data)
+        self.condition = condition
+
+        # the positions on our side, published with flush()
+        self.write_pos = self.header[_WRITE_POS]
+        self.read_pos = self.header[_READ_POS]
+        self.written = 0
+        self._pending_read = self.read_pos
+
+    @staticmethod
+    def allocate(context, capacity):
+        """The shared memory and the condition for a new ring, from a multiprocessing context."""
+        return context.RawArray('B', _HEADER_SIZE + capacity), context.Condition()
+
+    @property
+    def closed(self):
+        return bool(self.header[_CLOSED])
+
+    def close(self):
+        """Tell the other side to stop."""
+        with self.condition:
+            self.header[_CLOSED] = 1
+            self.condition.notify_all()
+
+    def get_user(self, i):
+        return self.header[_USER + i]
+
+    def set_user(self, i, value):
+        self.header[_USER + i] = value
+
+    @property
+    def records_written(self):
+        """The number of records published by the writer since the start."""
+        return self.header[_RECORDS_WRITTEN]
+
+    # writer side
+
+    def write(self, tag, *parts):
+        """Write a record made of all the parts, waiting for room if needed. It is visible after flush()."""
+        length = sum(len(part) for part in parts)
+        size = _RECORD_HEAD.size + length
+        if size > self.capacity:
+            raise ValueError('Record of {} bytes too big for the ring of {} bytes'.format(size, self.capacity))
+
+        offset = self.write_pos % self.capacity
+        if offset + size > self.capacity:
+            # no room until the end of the buffer, we go back to the start
+            padding = self.capacity - offset
+            self._wait_room(padding + size)
+            if padding >= _RECORD_HEAD.size:
+                _RECORD_HEAD.pack_into(self.data, offset, PAD, padding - _RECORD_HEAD.size)
+            self.write_pos += padding
+            offset = 0
+        else:
+            self._wait_room(size)
+
+        _RECORD_HEAD.pack_into(self.data, offset, tag, length)
+        offset += _RECORD_HEAD.size
+        for part in parts:
+            self.data[offset:offset + len(part)] = part
+            offset += len(part)
+        self.write_pos += size
+        self.written += 1
+
+    def flush(self):
+        """Make the records written visible to the reader."""
+        with self.condition:
+            self.header[_WRITE_POS] = self.write_pos
+            self.header[_RECORDS_WRITTEN] += self.written
+            self.written = 0
+            self.condition.notify_all()
+
+    def _wait_room(self, size):
+        if self.write_pos + size - self.read_pos <= self.capacity:
+            return
+
+        # the reader has to take some records first
+        self.flush()
+        with self.condition:
+            while True:
+                if self.header[_CLOSED]:
+                    raise RingClosed
+                self.read_pos = self.header[_READ_POS]
+                if self.write_pos + size - self.read_pos <= self.capacity:
+                    return
+                self.condition.wait(0.1)
+
+    # reader side
+
+    def read(self, max_records=None, timeout=None):
+        """
+        The records published and not read yet, as a list of (tag, payload).
+
+        The payloads are views on the shared memory, valid until release() is
+        called. If timeout is not None, wait at most that long for records.
+        """
+        with self.condition:
+            end = self.header[_WRITE_POS]
+            if end == self.read_pos and timeout:
+                self.condition.wait(timeout)
+                end = self.header[_WRITE_POS]
+
+        records = []
+        pos = self.read_pos
+        while pos < end and len(records) != max_records:
+            offset = pos % self.capacity
+            if self.capacity - offset < _RECORD_HEAD.size:
+                pos += self.capacity - offset
+                continue
+
+            tag, length = _RECORD_HEAD.unpack_from(self.data, offset)
+            pos += _RECORD_HEAD.size + length
+            if tag != PAD:
+                start = offset + _RECORD_HEAD.size
+                records.append((tag, self.data[start:start + length]))
+
+        self._pending_read = pos
+        return records
+
+    def release(self):
+        """Give back to the writer the room of the records returned by the last read()."""
+        with self.condition:
+            self.read_pos = self.header[_READ_POS] = self._pending_read
+            self.condition.notify_all()
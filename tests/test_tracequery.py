@@ -0,0 +1,63 @@
+"""The queries of tracequery.TraceQuery, compared to a search through all the ticks of the trace."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from batch import TICK_LIMIT, run_program
+from tracefile import MappedTrace
+from tracequery import TraceQuery
+
+TICKS = 3000
+
+
+@pytest.fixture(scope='module')
+def trace(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('traces') / 'fibonacci.trace')
+    result = run_program(os.path.join(ROOT, 'samples', 'fibonacci.dots'), TICKS, path)
+    assert result['status'] == TICK_LIMIT
+    trace = MappedTrace(path)
+    yield trace
+    trace.close()
+
+
+@pytest.fixture(scope='module')
+def frames(trace):
+    """The (uid, col, row, value) of the dots of each tick."""
+    return [[(f.uid[i], f.col[i], f.row[i], f.value[i]) for i in range(len(f))]
+            for f in (trace[tick] for tick in range(len(trace)))]
+
+
+def first(frames, match, uid=None):
+    for tick, dots in enumerate(frames):
+        for dot, _, _, value in dots:
+            if (uid is None or dot == uid) and match(value):
+                return tick
+    return None
+
+
+def test_first_values(trace, frames):
+    values = sorted({value for dots in frames for _, _, _, value in dots})
+    uids = sorted({dot for dots in frames for dot, _, _, _ in dots})
+    query = TraceQuery(trace)
+    for threshold in values[::max(1, len(values) // 10)] + [values[-1], values[0] - 1, 1e3, 0.5]:
+        for uid in [None] + uids[::max(1, len(uids) // 5)]:
+            hit = query.first_value_above(threshold, uid)
+            assert (hit and hit.tick) == first(frames, lambda value: value > threshold, uid)
+            hit = query.first_value_below(threshold, uid)
+            assert (hit and hit.tick) == first(frames, lambda value: value < threshold, uid)
+
+
+def test_ticks_on_cell(trace, frames):
+    cells = sorted({(col, row) for dots in frames for _, col, row, _ in dots})
+    query = TraceQuery(trace)
+    for col, row in cells[::max(1, len(cells) // 20)] + [(-5, -5)]:
+        ticks = [tick for tick, dots in enumerate(frames) if any(dot[1:3] == (col, row) for dot in dots)]
+        ranges = query.ticks_on_cell(col, row)
+        assert [tick for start, stop in ranges for tick in range(start, stop)] == ticks
+        assert [tick for start, stop in query.ticks_on_cell(col, row, 1000, 2000)
+                for tick in range(start, stop)] == [tick for tick in ticks if 1000 <= tick < 2000]
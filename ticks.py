@@ -0,0 +1,474 @@
+import sys
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+from dots import states
+from dots.vector import Pos
+from lineage import Lineage
+
+KEYFRAME_INTERVAL = 256
+MAX_HISTORY = 1000000  # ticks kept in memory by the debugger, by default
+NO_WAIT = -1
+
+DotRecord = namedtuple('DotRecord', 'uid pos id value state wait')
+DotRecord.__doc__ = """The state of a dot at a given tick, as recorded by the debugger."""
+
+TickDelta = namedtuple('TickDelta', 'tick changes deaths full')
+TickDelta.__doc__ = """
+The row_tuple()s of the dots changed at a microtick and the uids of the dead ones.
+If full, changes has all the dots of the tick and there are no deaths.
+"""
+
+# states are stored as small ints, the names are interned here
+STATE_NAMES = sorted(name for name, cls in vars(states).items()
+                     if isinstance(cls, type) and issubclass(cls, states.State))
+_STATE_CODES = {name: code for code, name in enumerate(STATE_NAMES)}
+
+
+def state_code(name):
+    """The code of a state name, new names are interned on the fly."""
+    try:
+        return _STATE_CODES[name]
+    except KeyError:
+        code = _STATE_CODES[name] = len(STATE_NAMES)
+        STATE_NAMES.append(name)
+        return code
+
+
+def append_int(column, value):
+    """
+    Append a value to a column of int64.
+
+    Ids are almost always small ints but can become floats or big ints with
+    some operations. In this case the column is converted to a list.
+    :return: the column, to use instead of the one given
+    """
+    if isinstance(column, array):
+        try:
+            column.append(value)
+            return column
+        except (TypeError, OverflowError):
+            column = list(column)
+
+    column.append(value)
+    return column
+
+
+class Frame:
+    """
+    All the dots of one tick, stored by columns.
+
+    Unless indexed is False, the frame also maps each cell (col, row) to the
+    rows of the dots on it, and keeps this index up to date as dots are added.
+    """
+
+    __slots__ = ('uid', 'col', 'row', 'id', 'value', 'state', 'wait', 'cells', 'tick', '_index')
+
+    def __init__(self, indexed=True):
+        self.tick = None  # the number of the microtick, when it's known
+        self.cells = {} if indexed else None  # type: Dict[Tuple[int, int], List[int]]
+        self.uid = array('q')
+        self.col = array('i')
+        self.row = array('i')
+        self.id = array('q')
+        self.value = []
+        self.state = array('B')
+        self.wait = array('q')
+        self._index = None
+
+    def __len__(self):
+        return len(self.uid)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.record(i)
+
+    def add(self, uid, col, row, id_, value, state, wait):
+        """Add a dot. state is a state code and wait is NO_WAIT when the dot isn't waiting."""
+        if self.cells is not None:
+            cell = self.cells.get((col, row))
+            if cell is None:
+                self.cells[col, row] = [len(self.uid)]
+            else:
+                cell.append(len(self.uid))
+
+        self.uid.append(uid)
+        self.col.append(col)
+        self.row.append(row)
+        self.id = append_int(self.id, id_)
+        self.value.append(value)
+        self.state.append(state)
+        self.wait.append(wait)
+        self._index = None
+
+    def row_tuple(self, i):
+        """All the columns of the dot i, in the order of add()."""
+        return (self.uid[i], self.col[i], self.row[i], self.id[i],
+                self.value[i], self.state[i], self.wait[i])
+
+    def record(self, i):
+        """The dot i as a DotRecord."""
+        wait = self.wait[i]
+        return DotRecord(self.uid[i], Pos(self.col[i], self.row[i]), self.id[i], self.value[i],
+                         STATE_NAMES[self.state[i]], None if wait == NO_WAIT else wait)
+
+    def drop(self, count):
+        """Forget the first count dots. Only for frames that are not indexed."""
+        for column in (self.uid, self.col, self.row, self.id, self.value, self.state, self.wait):
+            del column[:count]
+
+    def drop_from(self, count):
+        """Forget all the dots after the first count. Only for frames that are not indexed."""
+        for column in (self.uid, self.col, self.row, self.id, self.value, self.state, self.wait):
+            del column[count:]
+
+    def at(self, pos):
+        """The rows of the dots on the cell pos."""
+        return self.cells.get(tuple(pos), ())
+
+    def memory(self):
+        """Approximate size of the frame in bytes, without the big ids and values."""
+        size = sum(sys.getsizeof(column) for column in
+                   (self.uid, self.col, self.row, self.id, self.value, self.state, self.wait))
+        if self.cells is not None:
+            size += sys.getsizeof(self.cells) + sum(sys.getsizeof(rows) for rows in self.cells.values())
+        return size
+
+    @property
+    def index(self):
+        """Mapping uid -> row of this dot in the columns."""
+        if self._index is None:
+            self._index = {uid: i for i, uid in enumerate(self.uid)}
+        return self._index
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build a frame from an iterable of row_tuple()s."""
+        frame = cls()
+        for row in rows:
+            frame.add(*row)
+        return frame
+
+
+class DotRecorder:
+    """Turn the live dots of the interpreter into Frames."""
+
+    def __init__(self):
+        # the interpreter dots have no identity, so we give each one an uid for the whole execution
+        self._uids = weakref.WeakKeyDictionary()
+        self.next_uid = 0
+
+    def uid(self, dot):
+        """The unique id of a dot for this execution."""
+        try:
+            return self._uids[dot]
+        except KeyError:
+            uid = self._uids[dot] = self.next_uid
+            self.next_uid += 1
+            return uid
+
+    def register(self, dots, uids, next_uid):
+        """Give back their uids to dots restored from a checkpoint, and continue the numbering from next_uid."""
+        for dot, uid in zip(dots, uids):
+            self._uids[dot] = uid
+        self.next_uid = next_uid
+
+    def snapshot(self, dots):
+        """
+        Record all the given dots in a new Frame.
+
+        :type dots: list[dots.dot.Dot]
+        """
+        frame = Frame()
+        for dot in dots:
+            state = dot.state
+            wait = state.age if isinstance(state, states.TwoDotState) else NO_WAIT
+            frame.add(self.uid(dot), dot.pos.col, dot.pos.row, dot.id, dot.value,
+                      state_code(type(state).__name__), wait)
+        return frame
+
+
+class TickHistory:
+    """
+    Base of the histories of an execution.
+
+    A full Frame is kept every `keyframe_interval` ticks and only the changes for
+    the other ticks. Any tick can then be rebuilt by applying at most
+    `keyframe_interval` deltas to a keyframe.
+
+    Subclasses provide __len__, keyframe(), changes() and deaths(). The ticks
+    before `first` are forgotten, keyframes are counted from there.
+    """
+
+    first = 0
+    lineage = None  # type: Lineage
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self._clear_cache()
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def keyframe(self, index):
+        """The Frame of the tick index, that must be a keyframe."""
+        raise NotImplementedError
+
+    def changes(self, index):
+        """The row_tuple()s of the dots born or modified at this tick."""
+        raise NotImplementedError
+
+    def deaths(self, index):
+        """The uids of the dots that disappeared at this tick."""
+        raise NotImplementedError
+
+    def microtick(self, index):
+        """The number of the microtick of the interpreter that was recorded at this index."""
+        return index
+
+    def memory(self):
+        """Approximate number of bytes used by the history."""
+        return 0
+
+    def keyframe_start(self, index):
+        """The index of the keyframe to start from to rebuild the tick index."""
+        return index - (index - self.first) % self.keyframe_interval
+
+    def delta(self, index):
+        """The changes and deaths of the tick index, also for a keyframe, compared to the tick before."""
+        if index != self.keyframe_start(index):
+            return self.changes(index), self.deaths(index)
+        last = rows_by_uid(self[index - 1]) if index > self.first else {}
+        return diff(last, rows_by_uid(self.keyframe(index)))
+
+    def __getitem__(self, index):
+        """The Frame with all the dots alive at the given tick."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('tick index out of range')
+        if index < self.first:
+            raise IndexError('tick {} was forgotten'.format(index))
+
+        if index != self._cached_index:
+            self._cached_rows, self._cached_frame = self._rows_at(index)
+            self._cached_index = index
+        return self._cached_frame
+
+    def _clear_cache(self):
+        self._cached_index = None
+        self._cached_rows = None  # type: Dict[int, tuple]
+        self._cached_frame = None  # type: Frame
+
+    def _rows_at(self, index):
+        start = self.keyframe_start(index)
+
+        if start == index:
+            return None, self.keyframe(index)
+
+        # we can continue from the last tick built if it is between the keyframe and this one
+        if self._cached_index is not None and start <= self._cached_index < index:
+            start = self._cached_index
+            rows = self._cached_rows
+            if rows is None:
+                rows = rows_by_uid(self._cached_frame)
+        else:
+            rows = rows_by_uid(self.keyframe(start))
+
+        for tick in range(start + 1, index + 1):
+            for uid in self.deaths(tick):
+                del rows[uid]
+            for row in self.changes(tick):
+                rows[row[0]] = row
+
+        return rows, Frame.from_rows(rows.values())
+
+
+class TickStore(TickHistory):
+    """
+    The history of an execution, in memory.
+
+    The changes of all ticks are kept in flat columns, delimited by offsets for
+    each tick. The oldest ticks can be forgotten with trim() and the newest with
+    truncate(), to record them again from a checkpoint. The lineage of the dots
+    and the other `observers` are given the changes as the ticks are added.
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        super().__init__(keyframe_interval)
+
+        self.first = 0
+        self._clear()
+        # the whole life of the dots, it is not forgotten with the ticks
+        self.lineage = Lineage()
+        # objects with add(index, changes, deaths), like the lineage, called for each tick,
+        # and truncate(length, dots) with the dots alive at the last tick kept
+        self.observers = [self.lineage]
+
+        # the microticks not recorded (when running to a breakpoint) make jumps in the numbering
+        self._jump_indices = array('Q', [0])
+        self._jump_ticks = array('Q', [0])
+
+    def _clear(self):
+        self._keyframes = []  # type: List[Frame]
+        # the memory of each keyframe and their sum, measured once as they are added
+        self._keyframe_sizes = array('Q')
+        self._keyframes_memory = 0
+        self._changes = Frame(indexed=False)
+        self._change_starts = array('Q', [0])
+        self._deaths = array('q')
+        self._death_starts = array('Q', [0])
+
+        self._last = {}  # type: Dict[int, tuple]
+        self._clear_cache()
+
+    def __len__(self):
+        return self.first + len(self._change_starts) - 1
+
+    def append(self, tick):
+        """Add the next tick to the history, given as a Frame or as a TickDelta."""
+        self._number(tick.tick)
+        if isinstance(tick, TickDelta):
+            if not tick.full:
+                return self.append_delta(tick.changes, tick.deaths)
+            current = {row[0]: row for row in tick.changes}
+            frame = None
+        else:
+            current = rows_by_uid(tick)
+            frame = tick
+
+        changes, deaths = diff(self._last, current)
+        self._add(changes, deaths, current, frame)
+
+    def append_delta(self, changes, deaths):
+        """Add the next tick to the history, given by the rows that changed and the uids of the dead dots."""
+        current = self._last
+        for uid in deaths:
+            del current[uid]
+        for row in changes:
+            current[row[0]] = row
+        self._add(changes, deaths, current)
+
+    def _number(self, tick):
+        """Record the microtick of the next index, when it doesn't follow the previous one."""
+        if tick is not None and tick != self.microtick(len(self)):
+            self._jump_indices.append(len(self))
+            self._jump_ticks.append(tick)
+
+    def _add(self, changes, deaths, current, frame=None):
+        for observer in self.observers:
+            observer.add(len(self), changes, deaths)
+        for row in changes:
+            self._changes.add(*row)
+        self._deaths.extend(deaths)
+
+        if (len(self) - self.first) % self.keyframe_interval == 0:
+            if frame is None:
+                frame = Frame.from_rows(current.values())
+            self._keyframes.append(frame)
+            self._keyframe_sizes.append(frame.memory())
+            self._keyframes_memory += self._keyframe_sizes[-1]
+
+        self._change_starts.append(len(self._changes))
+        self._death_starts.append(len(self._deaths))
+        self._last = current
+
+    def trim(self, index):
+        """Forget the ticks before index, or rather before the keyframe before it."""
+        index = self.keyframe_start(min(index, len(self) - 1))
+        count = index - self.first
+        if count <= 0:
+            return
+
+        changes, deaths = self._change_starts[count], self._death_starts[count]
+        self._changes.drop(changes)
+        del self._deaths[:deaths]
+        self._change_starts = array('Q', (start - changes for start in self._change_starts[count:]))
+        self._death_starts = array('Q', (start - deaths for start in self._death_starts[count:]))
+        del self._keyframes[:count // self.keyframe_interval]
+        self._forget_keyframe_sizes(0, count // self.keyframe_interval)
+
+        self.first = index
+        self._clear_cache()
+
+    def truncate(self, length):
+        """Forget the ticks from length onwards."""
+        if length >= len(self):
+            return
+
+        jumps = bisect_left(self._jump_indices, length, 1)
+        del self._jump_indices[jumps:]
+        del self._jump_ticks[jumps:]
+
+        if length <= self.first:
+            # nothing is left, we restart from there
+            self.first = length
+            self._clear()
+        else:
+            self._clear_cache()
+            count = length - self.first
+            self._changes.drop_from(self._change_starts[count])
+            del self._deaths[self._death_starts[count]:]
+            del self._change_starts[count + 1:]
+            del self._death_starts[count + 1:]
+            del self._keyframes[(count - 1) // self.keyframe_interval + 1:]
+            self._forget_keyframe_sizes((count - 1) // self.keyframe_interval + 1, len(self._keyframe_sizes))
+            self._last = rows_by_uid(self[length - 1])
+
+        # the ticks given again may be numbered differently, when some were skipped before
+        for observer in self.observers:
+            observer.truncate(length, self._last)
+
+    def keyframe(self, index):
+        return self._keyframes[(index - self.first) // self.keyframe_interval]
+
+    def _forget_keyframe_sizes(self, start, stop):
+        self._keyframes_memory -= sum(self._keyframe_sizes[start:stop])
+        del self._keyframe_sizes[start:stop]
+
+    def memory(self):
+        # the keyframes are counted as they come and go, the columns are measured without walking them
+        arrays = (self._change_starts, self._deaths, self._death_starts, self._jump_indices,
+                  self._jump_ticks, self._keyframe_sizes)
+        return self._changes.memory() + self._keyframes_memory + sum(sys.getsizeof(a) for a in arrays)
+
+    def changes(self, index):
+        changes = self._changes
+        index -= self.first
+        return [changes.row_tuple(i) for i in range(self._change_starts[index], self._change_starts[index + 1])]
+
+    def deaths(self, index):
+        index -= self.first
+        return self._deaths[self._death_starts[index]:self._death_starts[index + 1]]
+
+    def microtick(self, index):
+        jump = bisect_right(self._jump_indices, index) - 1
+        return self._jump_ticks[jump] + index - self._jump_indices[jump]
+
+    def index_of(self, tick):
+        """The first index that recorded the microtick tick or a later one."""
+        jump = bisect_right(self._jump_ticks, tick) - 1
+        index = self._jump_indices[jump] + tick - self._jump_ticks[jump]
+        if jump + 1 < len(self._jump_indices):
+            # this tick was skipped, the next one recorded is the start of the next jump
+            index = min(index, self._jump_indices[jump + 1])
+        return index
+
+
+def rows_by_uid(frame):
+    """Mapping uid -> row_tuple() of all the dots of a frame."""
+    return {row[0]: row for row in map(frame.row_tuple, range(len(frame)))}
+
+
+def diff(last, current):
+    """
+    The changes between two ticks given as mappings uid -> row_tuple().
+
+    :return: the rows that are new or changed and the uids of the dots that died
+    """
+    changes = [row for uid, row in current.items() if last.get(uid) != row]
+    deaths = [uid for uid in last if uid not in current]
+    return changes, deaths
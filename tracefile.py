@@ -0,0 +1,783 @@
+import json
+import math
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, Tuple
+
+from lineage import DotLineage, Lineage
+from ticks import KEYFRAME_INTERVAL, Frame, TickHistory, diff, rows_by_uid
+
+MAGIC = b'DOTTRACE'
+VERSION = 4
+
+# record tags
+TICK = b'T'
+KEYFRAME = b'K'
+OUTPUT = b'O'
+END = b'E'
+
+_RECORD_HEAD = struct.Struct('<cI')  # tag, length of the payload
+_TICK_HEAD = struct.Struct('<II')  # number of changes, number of deaths
+_ROW = struct.Struct('<qiiBq')  # uid, col, row, state, wait
+_UID = struct.Struct('<q')
+_OUTPUT_HEAD = struct.Struct('<Q')  # tick
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_LENGTH = struct.Struct('<I')
+_HEADER = struct.Struct('<HI')  # version, length of the json
+# offset of the index, number of ticks, number of outputs, offset of the lineage, of the query index, MAGIC
+_FOOTER = struct.Struct('<QQQQQ8s')
+_LINEAGE_HEAD = struct.Struct('<qqqII')  # birth, death or -1, last tick changed, number of segments and of values
+_COUNT = struct.Struct('<Q')
+
+
+# tags of the numbers
+_INT_TAG = ord('i')
+_FLOAT_TAG = ord('f')
+_BIG_INT_TAG = ord('b')
+
+
+def pack_number(x):
+    """Encode the id or value of a dot."""
+    if isinstance(x, float):
+        return bytes((_FLOAT_TAG,)) + _FLOAT.pack(x)
+    if -2 ** 63 <= x < 2 ** 63:
+        return bytes((_INT_TAG,)) + _INT.pack(x)
+    text = str(x).encode()
+    return bytes((_BIG_INT_TAG,)) + _LENGTH.pack(len(text)) + text
+
+
+def unpack_number(buffer, offset):
+    """Decode a number encoded by pack_number. Returns the number and the offset after it."""
+    tag = buffer[offset]
+    offset += 1
+    if tag == _INT_TAG:
+        return _INT.unpack_from(buffer, offset)[0], offset + _INT.size
+    if tag == _FLOAT_TAG:
+        return _FLOAT.unpack_from(buffer, offset)[0], offset + _FLOAT.size
+    length, = _LENGTH.unpack_from(buffer, offset)
+    offset += _LENGTH.size
+    return int(bytes(buffer[offset:offset + length])), offset + length
+
+
+def pack_tick(changes, deaths):
+    """Encode the payload of a tick (or a keyframe, with all the dots and no deaths)."""
+    parts = [_TICK_HEAD.pack(len(changes), len(deaths))]
+    for uid, col, row, id_, value, state, wait in changes:
+        parts.append(_ROW.pack(uid, col, row, state, wait))
+        parts.append(pack_number(id_))
+        parts.append(pack_number(value))
+    parts.extend(_UID.pack(uid) for uid in deaths)
+    return b''.join(parts)
+
+
+def unpack_tick(buffer, offset=0):
+    """Decode the payload of a tick into the list of the rows changed and the uids of the dead dots."""
+    n_changes, n_deaths = _TICK_HEAD.unpack_from(buffer, offset)
+    offset += _TICK_HEAD.size
+
+    changes = []
+    for _ in range(n_changes):
+        uid, col, row, state, wait = _ROW.unpack_from(buffer, offset)
+        id_, offset = unpack_number(buffer, offset + _ROW.size)
+        value, offset = unpack_number(buffer, offset)
+        changes.append((uid, col, row, id_, value, state, wait))
+
+    deaths = [_UID.unpack_from(buffer, offset + i * _UID.size)[0] for i in range(n_deaths)]
+    return changes, deaths
+
+
+def find_local_libs(program, program_dir):
+    """
+    Read all the libraries imported by a program that are in its directory.
+
+    :return: a dict filename -> code, including the libraries imported by the libraries.
+    """
+    libs = {}
+    to_read = [program]
+    while to_read:
+        for line in to_read.pop().split('\n'):
+            if not line.startswith('%!'):
+                continue
+
+            filename = line[2:].split(' ')[0]
+            path = os.path.join(program_dir, filename)
+            if filename not in libs and os.path.isfile(path):
+                with open(path, encoding='utf-8') as f:
+                    libs[filename] = f.read()
+                to_read.append(libs[filename])
+    return libs
+
+
+def _index_array(values):
+    """The bytes of an array of uint64, in little endian."""
+    values = array('Q', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def pack_lineage(lineage):
+    """
+    Encode a lineage.Lineage.
+
+    It starts with the number of dots, their uids in order and the offsets of
+    their records from the start, as arrays of little endian uint64. A record is
+    a _LINEAGE_HEAD, the start ticks and the moves of the segments, the ticks
+    where the value changed (all as int64), and the values.
+    """
+    uids = sorted(lineage.dots)
+    records = []
+    offset = _COUNT.size + 16 * len(uids)
+    offsets = []
+    for uid in uids:
+        dot = lineage.dots[uid]
+        parts = [_LINEAGE_HEAD.pack(dot.birth, -1 if dot.death is None else dot.death, dot.last,
+                                    len(dot.starts), len(dot.values))]
+        parts.extend(_int64_array(values) for values in (dot.starts, dot.moves, dot.value_ticks))
+        parts.extend(pack_number(value) for value in dot.values)
+        record = b''.join(parts)
+        offsets.append(offset)
+        records.append(record)
+        offset += len(record)
+
+    return b''.join([_COUNT.pack(len(uids)), _index_array(uids), _index_array(offsets)] + records)
+
+
+def _int64_array(values):
+    values = array('q', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _float64_array(values):
+    values = array('d', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _as_float(value):
+    """The float closest to a number, infinite for the ints too big for a float."""
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def _cell_key(col, row):
+    """A cell as one uint64, sorted by row then col."""
+    return (row + 2 ** 31) << 32 | (col + 2 ** 31)
+
+
+class CellIntervals:
+    """
+    The ticks during which each cell had at least one dot, built as the ticks are written.
+
+    The intervals of a cell are kept in one array of bounds, start included and
+    end excluded: [start, end, start, end...]. They never touch, so the bounds
+    are strictly increasing. The last interval of a cell with a dot is closed
+    only by bounds().
+    """
+
+    def __init__(self):
+        self.length = 0  # the number of ticks seen
+        self._bounds = {}  # type: Dict[Tuple[int, int], array]
+        self._counts = {}  # type: Dict[Tuple[int, int], int]  # the number of dots on each cell
+        self._cells = {}  # type: Dict[int, Tuple[int, int]]  # uid -> cell
+
+    def add(self, tick, changes, deaths):
+        """Add the next tick, like lineage.Lineage.add()."""
+        if tick < self.length:
+            return
+        self.length = tick + 1
+
+        for uid in deaths:
+            self._leave(self._cells.pop(uid), tick)
+        cells = self._cells
+        for uid, col, row, _, _, _, _ in changes:
+            last = cells.get(uid)
+            if last != (col, row):
+                if last is not None:
+                    self._leave(last, tick)
+                self._enter((col, row), tick)
+                cells[uid] = col, row
+
+    def _enter(self, cell, tick):
+        count = self._counts.get(cell, 0)
+        self._counts[cell] = count + 1
+        if count:
+            return
+        bounds = self._bounds.get(cell)
+        if bounds is None:
+            self._bounds[cell] = array('q', [tick])
+        elif bounds[-1] == tick:
+            # a dot left at this tick, the interval continues
+            bounds.pop()
+        else:
+            bounds.append(tick)
+
+    def _leave(self, cell, tick):
+        count = self._counts.pop(cell) - 1
+        if count:
+            self._counts[cell] = count
+        else:
+            self._bounds[cell].append(tick)
+
+    def bounds(self):
+        """The bounds of the intervals of each cell, the ones still open end after the last tick."""
+        return {cell: bounds + array('q', [self.length]) if len(bounds) % 2 else bounds
+                for cell, bounds in self._bounds.items()}
+
+
+class ValueRecords:
+    """
+    The values greater, or less, than all the values before them, among all the dots.
+
+    The first tick where any dot had a value above a threshold is then the tick
+    of the first record above it. Built as the ticks are written.
+    """
+
+    def __init__(self):
+        self.length = 0  # the number of ticks seen
+        # the tick, uid and value of each record
+        self.highs = array('q'), array('q'), []
+        self.lows = array('q'), array('q'), []
+
+    def add(self, tick, changes, deaths):
+        """Add the next tick, like lineage.Lineage.add()."""
+        if tick < self.length:
+            return
+        self.length = tick + 1
+
+        high_ticks, high_uids, highs = self.highs
+        low_ticks, low_uids, lows = self.lows
+        for uid, _, _, _, value, _, _ in changes:
+            if not highs or value > highs[-1]:
+                high_ticks.append(tick)
+                high_uids.append(uid)
+                highs.append(value)
+            if not lows or value < lows[-1]:
+                low_ticks.append(tick)
+                low_uids.append(uid)
+                lows.append(value)
+
+
+def pack_query_index(cells, records, lineage):
+    """
+    Encode the index of the queries of a trace, from its CellIntervals, ValueRecords and lineage.Lineage.
+
+    For the values, it has the number of dots, their uids in order, and for each
+    the start of its values in the next arrays: the ticks where the value
+    changed, the maximum and minus the minimum of the values until then as
+    float64 (so both grow), and one byte telling if all the values were exact
+    as floats. For the cells, the number of cells, their _cell_key() in order,
+    the start of their bounds and the CellIntervals bounds of all the cells.
+    Then the records of the highest values and of the lowest: their number,
+    their ticks, their uids and their values as float64 (minus the value for
+    the lowest), and one byte telling if all the records were exact as floats.
+    All in little endian.
+    """
+    uids = sorted(lineage.dots)
+    value_starts = [0]
+    exact = bytearray()
+    ticks, maxima, neg_minima = array('q'), array('d'), array('d')
+    for uid in uids:
+        dot = lineage.dots[uid]
+        ticks.extend(dot.value_ticks)
+        high = low = None
+        all_exact = True
+        for value in dot.values:
+            number = _as_float(value)
+            all_exact = all_exact and number == value
+            high = number if high is None else max(high, number)
+            low = number if low is None else min(low, number)
+            maxima.append(high)
+            neg_minima.append(-low)
+        exact.append(all_exact)
+        value_starts.append(len(ticks))
+
+    bounds = cells.bounds()
+    keys = sorted(bounds, key=lambda cell: _cell_key(*cell))
+    bound_starts = [0]
+    for cell in keys:
+        bound_starts.append(bound_starts[-1] + len(bounds[cell]))
+
+    parts = [_COUNT.pack(len(uids)), _index_array(uids), _index_array(value_starts), bytes(exact),
+             _int64_array(ticks), _float64_array(maxima), _float64_array(neg_minima),
+             _COUNT.pack(len(keys)), _index_array(_cell_key(*cell) for cell in keys), _index_array(bound_starts)]
+    parts.extend(_int64_array(bounds[cell]) for cell in keys)
+
+    all_exact = True
+    for (record_ticks, record_uids, values), sign in ((records.highs, 1), (records.lows, -1)):
+        numbers = [_as_float(value) for value in values]
+        all_exact = all_exact and numbers == values
+        parts.extend((_COUNT.pack(len(values)), _int64_array(record_ticks), _int64_array(record_uids),
+                      _float64_array(sign * number for number in numbers)))
+    parts.append(bytes((all_exact,)))
+    return b''.join(parts)
+
+
+class TraceWriter:
+    """
+    Stream an execution to a binary trace file.
+
+    A trace starts with MAGIC, a version and a json header with the program,
+    followed by records made of a tag, the length of the payload and the payload:
+        TICK      the rows of the dots that changed and the uids of the dead ones
+        KEYFRAME  the rows of all the dots, every `keyframe_interval` ticks
+        OUTPUT    the tick that produced it and the text
+        END       nothing, the execution is over
+    After the END come the lineage of the dots (see pack_lineage()), the index
+    of the queries (see pack_query_index()) and the index: the offsets of the
+    records of every tick, the ticks of the outputs and the offsets of their
+    records, as arrays of little endian uint64. The footer, at the very end,
+    tells where they are.
+    """
+
+    def __init__(self, path, program, program_dir, keyframe_interval=KEYFRAME_INTERVAL):
+        self.file = open(path, 'wb')
+        self.keyframe_interval = keyframe_interval
+        self.ticks = 0
+        self.lineage = Lineage()
+        self.cells = CellIntervals()
+        self.records = ValueRecords()
+        self._last = {}
+
+        self._tick_offsets = array('Q')
+        self._output_ticks = array('Q')
+        self._output_offsets = array('Q')
+
+        header = json.dumps({
+            'program': program,
+            'program_dir': program_dir,
+            'libs': find_local_libs(program, program_dir),
+            'keyframe_interval': keyframe_interval,
+        }).encode()
+        self.file.write(MAGIC + _HEADER.pack(VERSION, len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write_tick(self, frame):
+        """Append the next tick, given as a ticks.Frame."""
+        current = rows_by_uid(frame)
+        changes, deaths = diff(self._last, current)
+        self.lineage.add(self.ticks, changes, deaths)
+        self.cells.add(self.ticks, changes, deaths)
+        self.records.add(self.ticks, changes, deaths)
+
+        self._tick_offsets.append(self.file.tell())
+        if self.ticks % self.keyframe_interval == 0:
+            self._write(KEYFRAME, pack_tick(list(current.values()), ()))
+        else:
+            self._write(TICK, pack_tick(changes, deaths))
+
+        self._last = current
+        self.ticks += 1
+
+    def write_output(self, text):
+        """Append an output of the program, produced by the tick being computed."""
+        self._output_ticks.append(self.ticks)
+        self._output_offsets.append(self.file.tell())
+        self._write(OUTPUT, _OUTPUT_HEAD.pack(self.ticks) + str(text).encode())
+
+    def close(self):
+        if self.file.closed:
+            return
+
+        self._write(END, b'')
+        lineage = self.file.tell()
+        self.file.write(pack_lineage(self.lineage))
+        queries = self.file.tell()
+        self.file.write(pack_query_index(self.cells, self.records, self.lineage))
+        index = self.file.tell()
+        for values in (self._tick_offsets, self._output_ticks, self._output_offsets):
+            self.file.write(_index_array(values))
+        self.file.write(_FOOTER.pack(index, len(self._tick_offsets), len(self._output_ticks), lineage, queries,
+                                     MAGIC))
+        self.file.close()
+
+    def _write(self, tag, payload):
+        self.file.write(_RECORD_HEAD.pack(tag, len(payload)))
+        self.file.write(payload)
+
+
+class MappedTrace(TickHistory):
+    """
+    Random access to the ticks of a trace file.
+
+    The file is memory-mapped and the index is read in place, so opening a trace
+    and going to any tick takes the same time whatever its length, and only
+    the pages that are read stay in memory.
+    """
+
+    def __init__(self, path):
+        self._libs_dir = None  # where the libraries are written by get_program_dir(), if needed
+        self._lineage = None  # type: TraceLineage
+        self._queries = None  # type: QueryIndex
+        self.file = open(path, 'rb')
+        # checked before the mapping, an empty file can't be mapped
+        head = self.file.read(len(MAGIC) + _HEADER.size)
+        if len(head) < len(MAGIC) + _HEADER.size or head[:len(MAGIC)] != MAGIC:
+            self.file.close()
+            raise ValueError('{} is not a trace file'.format(path))
+        version, length = _HEADER.unpack_from(head, len(MAGIC))
+        if version != VERSION:
+            self.file.close()
+            raise ValueError('Unsupported trace version: {}'.format(version))
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self.map)
+        start = len(MAGIC) + _HEADER.size
+        try:
+            header = json.loads(self.map[start:start + length].decode())
+            self.program = header['program']
+            self.program_dir = header['program_dir']
+            self.libs = header['libs']
+            keyframe_interval = header['keyframe_interval']
+        except (ValueError, KeyError, TypeError):
+            self.close()
+            raise ValueError('{} is not a trace file, its header is broken'.format(path))
+        super().__init__(keyframe_interval)
+
+        self._records_start = start + length
+        self._lineage_offset = None  # in the footer, unless the recording was interrupted
+        self._queries_offset = None  # also in the footer
+        self._tick_offsets, self._output_ticks, self._output_offsets = self._read_index()
+        self.outputs = TraceOutputs(self)
+
+    def __len__(self):
+        return len(self._tick_offsets)
+
+    def _read_index(self):
+        """The three arrays of the index, read from the footer or rebuilt if the recording was interrupted."""
+        if len(self.map) - _FOOTER.size < self._records_start:
+            return self._scan_records()
+
+        index, n_ticks, n_outputs, lineage, queries, magic = _FOOTER.unpack_from(self.map,
+                                                                                len(self.map) - _FOOTER.size)
+        if magic == MAGIC and sys.byteorder == 'little':
+            self._lineage_offset = lineage
+            self._queries_offset = queries
+            arrays = []
+            for length in (n_ticks, n_outputs, n_outputs):
+                arrays.append(self._view[index:index + 8 * length].cast('Q'))
+                index += 8 * length
+            return arrays
+
+        return self._scan_records()
+
+    def _scan_records(self):
+        ticks, output_ticks, output_offsets = array('Q'), array('Q'), array('Q')
+        offset = self._records_start
+        while offset + _RECORD_HEAD.size <= len(self.map):
+            tag, length = _RECORD_HEAD.unpack_from(self.map, offset)
+            if tag == END or offset + _RECORD_HEAD.size + length > len(self.map):
+                break
+            if tag == OUTPUT:
+                output_ticks.append(_OUTPUT_HEAD.unpack_from(self.map, offset + _RECORD_HEAD.size)[0])
+                output_offsets.append(offset)
+            else:
+                ticks.append(offset)
+            offset += _RECORD_HEAD.size + length
+        return ticks, output_ticks, output_offsets
+
+    def _payload(self, offset):
+        tag, length = _RECORD_HEAD.unpack_from(self.map, offset)
+        offset += _RECORD_HEAD.size
+        return tag, self._view[offset:offset + length]
+
+    def keyframe(self, index):
+        _, payload = self._payload(self._tick_offsets[index])
+        changes, _ = unpack_tick(payload)
+        return Frame.from_rows(changes)
+
+    # TickHistory asks for the changes and deaths of the ticks after a keyframe, never of a keyframe
+
+    def changes(self, index):
+        _, payload = self._payload(self._tick_offsets[index])
+        return unpack_tick(payload)[0]
+
+    def deaths(self, index):
+        _, payload = self._payload(self._tick_offsets[index])
+        return unpack_tick(payload)[1]
+
+    @property
+    def lineage(self):
+        """The lineage of the dots, read from the file, or built from the ticks if the recording was interrupted."""
+        if self._lineage is None:
+            if self._lineage_offset is not None:
+                self._lineage = TraceLineage(self._view, self._lineage_offset)
+            else:
+                self._lineage = Lineage.from_history(self)
+        return self._lineage
+
+    @property
+    def queries(self):
+        """The QueryIndex of the trace, read from the file, or built from the ticks if the recording was interrupted."""
+        if self._queries is None:
+            if self._queries_offset is not None:
+                self._queries = QueryIndex(self._view, self._queries_offset)
+            else:
+                cells, records = CellIntervals(), ValueRecords()
+                for tick in range(len(self)):
+                    changes, deaths = self.delta(tick)
+                    cells.add(tick, changes, deaths)
+                    records.add(tick, changes, deaths)
+                self._queries = QueryIndex(memoryview(pack_query_index(cells, records, self.lineage)), 0)
+        return self._queries
+
+    def memory(self):
+        """The size of the file, that is mapped. Only the parts read are really in memory."""
+        return len(self.map)
+
+    def output_at(self, tick):
+        """The last output produced at or before the given tick, as (tick, text), or None."""
+        return self.outputs.at(tick)
+
+    def get_program_dir(self):
+        """
+        A directory where the program can find its libraries.
+
+        If the trace was recorded on another computer, the libraries are
+        written to a temporary directory, removed when the trace is closed.
+        Raise ValueError if a library would be written outside of it.
+        """
+        for lib in self.libs:
+            # the names come from the file, they could be anything
+            if os.path.isabs(lib) or os.path.normpath(lib).split(os.sep)[0] == os.pardir:
+                raise ValueError('Invalid library name in the trace: {}'.format(lib))
+        if all(os.path.isfile(os.path.join(self.program_dir, lib)) for lib in self.libs):
+            return self.program_dir
+        if self._libs_dir is not None:
+            return self._libs_dir
+
+        directory = tempfile.mkdtemp(prefix='dots-trace-')
+        self._libs_dir = directory
+        for filename, code in self.libs.items():
+            path = os.path.realpath(os.path.join(directory, filename))
+            if os.path.commonpath((path, os.path.realpath(directory))) != os.path.realpath(directory):
+                raise ValueError('Invalid library name in the trace: {}'.format(filename))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(code)
+        return directory
+
+    def close(self):
+        # the views on the map must be released before it can be closed
+        if isinstance(self._lineage, TraceLineage):
+            self._lineage.release()
+        if self._queries is not None:
+            self._queries.release()
+        for view in (getattr(self, '_tick_offsets', None), getattr(self, '_output_ticks', None),
+                     getattr(self, '_output_offsets', None), self._view):
+            if isinstance(view, memoryview):
+                view.release()
+        self.map.close()
+        self.file.close()
+        self.remove_program_dir()
+
+    def remove_program_dir(self):
+        """Remove the libraries written by get_program_dir(), once the program is parsed."""
+        if self._libs_dir is not None:
+            shutil.rmtree(self._libs_dir, ignore_errors=True)
+            self._libs_dir = None
+
+
+class TraceLineage:
+    """The lineage.Lineage of a trace, each DotLineage is decoded from the file when it is asked."""
+
+    def __init__(self, view, offset):
+        """
+        :param memoryview view: the whole file
+        :param int offset: where the lineage starts
+        """
+        self._view = view
+        self._start = offset
+        count, = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        self._uids = view[offset:offset + 8 * count].cast('Q')
+        self._offsets = view[offset + 8 * count:offset + 16 * count].cast('Q')
+
+    def __len__(self):
+        return len(self._uids)
+
+    def get(self, uid):
+        """The DotLineage of a dot, or None if it was never seen."""
+        i = bisect_left(self._uids, uid)
+        if i == len(self._uids) or self._uids[i] != uid:
+            return None
+
+        offset = self._start + self._offsets[i]
+        birth, death, last, n_segments, n_values = _LINEAGE_HEAD.unpack_from(self._view, offset)
+        offset += _LINEAGE_HEAD.size
+
+        dot = DotLineage(uid, birth, 0, 0, None)
+        dot.death = None if death < 0 else death
+        dot.last = last
+        for name, length in (('starts', n_segments), ('moves', 4 * n_segments), ('value_ticks', n_values)):
+            setattr(dot, name, array('q', self._view[offset:offset + 8 * length].cast('q')))
+            offset += 8 * length
+        dot.values = []
+        for _ in range(n_values):
+            value, offset = unpack_number(self._view, offset)
+            dot.values.append(value)
+        return dot
+
+    def release(self):
+        self._uids.release()
+        self._offsets.release()
+
+
+class QueryIndex:
+    """
+    The index of the queries of a trace, read in place.
+
+    The values of each dot can be searched with a binary search on the running
+    maximum (or minimum) of its values, and the ticks when a cell had a dot are
+    one slice of bounds.
+    """
+
+    def __init__(self, view, offset):
+        """
+        :param memoryview view: the whole file
+        :param int offset: where the index starts
+        """
+        self._views = []
+
+        def take(count, size, fmt):
+            nonlocal offset
+            part = view[offset:offset + count * size].cast(fmt)
+            offset += count * size
+            self._views.append(part)
+            return part
+
+        count, = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        self._uids = take(count, 8, 'Q')
+        self._value_starts = take(count + 1, 8, 'Q')
+        self._exact = take(count, 1, 'B')
+        values = self._value_starts[count]
+        self._value_ticks = take(values, 8, 'q')
+        self._maxima = take(values, 8, 'd')
+        self._neg_minima = take(values, 8, 'd')
+
+        count, = _COUNT.unpack_from(view, offset)
+        offset += _COUNT.size
+        self._cells = take(count, 8, 'Q')
+        self._bound_starts = take(count + 1, 8, 'Q')
+        self._bounds = take(self._bound_starts[count], 8, 'q')
+
+        self._records = []  # (ticks, uids, values) of the highest values then of the lowest
+        for _ in range(2):
+            count, = _COUNT.unpack_from(view, offset)
+            offset += _COUNT.size
+            self._records.append((take(count, 8, 'q'), take(count, 8, 'q'), take(count, 8, 'd')))
+        self.exact_records = bool(view[offset])  # if not, first_above_any() and first_below_any() can't be used
+
+    @property
+    def uids(self):
+        """The uids of all the dots, in order."""
+        return self._uids
+
+    def exact(self, uid):
+        """Whether all the values of the dot are exact as floats, so first_above() and first_below() can be used."""
+        i = self._find(uid)
+        return i is not None and bool(self._exact[i])
+
+    def first_above(self, uid, threshold):
+        """The first tick where the value of the dot was greater than threshold, or None."""
+        return self._first(uid, self._maxima, threshold)
+
+    def first_below(self, uid, threshold):
+        """The first tick where the value of the dot was less than threshold, or None."""
+        return self._first(uid, self._neg_minima, -threshold)
+
+    def _first(self, uid, running, threshold):
+        i = self._find(uid)
+        if i is None:
+            return None
+        start, end = self._value_starts[i], self._value_starts[i + 1]
+        found = bisect_right(running, threshold, start, end)
+        return self._value_ticks[found] if found < end else None
+
+    def first_above_any(self, threshold):
+        """The first (tick, uid) where the value of a dot was greater than threshold, or None."""
+        return self._first_record(self._records[0], threshold)
+
+    def first_below_any(self, threshold):
+        """The first (tick, uid) where the value of a dot was less than threshold, or None."""
+        return self._first_record(self._records[1], -threshold)
+
+    @staticmethod
+    def _first_record(records, threshold):
+        ticks, uids, values = records
+        i = bisect_right(values, threshold)
+        return (ticks[i], uids[i]) if i < len(values) else None
+
+    def _find(self, uid):
+        i = bisect_left(self._uids, uid)
+        return i if i < len(self._uids) and self._uids[i] == uid else None
+
+    def cell_bounds(self, col, row):
+        """The bounds of the intervals of ticks when a dot was on the cell, see CellIntervals."""
+        key = _cell_key(col, row)
+        i = bisect_left(self._cells, key)
+        if i == len(self._cells) or self._cells[i] != key:
+            return self._bounds[0:0]
+        return self._bounds[self._bound_starts[i]:self._bound_starts[i + 1]]
+
+    def release(self):
+        for view in self._views:
+            view.release()
+
+
+class TraceOutputs:
+    """The outputs of a MappedTrace, with the interface of outputs.OutputLog. They are decoded only when asked."""
+
+    def __init__(self, trace):
+        """
+        :param MappedTrace trace:
+        """
+        self.trace = trace
+
+    def __len__(self):
+        return len(self.trace._output_ticks)
+
+    @property
+    def ticks(self):
+        """The tick of each output, in order."""
+        return self.trace._output_ticks
+
+    def __getitem__(self, i):
+        """The output i, as (tick, text)."""
+        if i < 0:
+            i += len(self)
+        _, payload = self.trace._payload(self.trace._output_offsets[i])
+        return self.trace._output_ticks[i], bytes(payload[_OUTPUT_HEAD.size:]).decode()
+
+    def count_until(self, tick):
+        """The number of outputs produced at or before the tick."""
+        return bisect_right(self.trace._output_ticks, tick)
+
+    def printed_at(self, tick):
+        """Whether the tick printed something."""
+        ticks = self.trace._output_ticks
+        i = bisect_left(ticks, tick)
+        return i < len(ticks) and ticks[i] == tick
+
+    def at(self, tick):
+        """The last output produced at or before the tick, as (tick, text), or None."""
+        i = self.count_until(tick) - 1
+        return self[i] if i >= 0 else None
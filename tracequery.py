@@ -0,0 +1,117 @@
+"""
+Search a recorded trace without the debugger, from Python or with `debugger.py query`.
+
+The queries read the indexes written at the end of the trace (the outputs, the
+lineage of the dots and tracefile.QueryIndex), so they take the same time
+whatever the length of the execution:
+
+    with TraceQuery('primes.trace') as query:
+        query.first_value_above(1000, uid=42)
+        query.ticks_on_cell(12, 4)
+        query.output_ticks()
+"""
+
+from bisect import bisect_right
+from collections import namedtuple
+
+from tracefile import MappedTrace
+
+Hit = namedtuple('Hit', 'tick uid')
+Hit.__doc__ = """The first tick where a dot matched a query, and the uid of this dot."""
+
+
+class TraceQuery:
+    """Queries on a tracefile.MappedTrace. The ticks are the indices of the trace, like in the debugger."""
+
+    def __init__(self, trace):
+        """
+        :param trace: the path of a trace or a MappedTrace, which is then not closed with the query
+        """
+        self._owned = not isinstance(trace, MappedTrace)
+        self.trace = MappedTrace(trace) if self._owned else trace
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        """The number of ticks of the trace."""
+        return len(self.trace)
+
+    def close(self):
+        if self._owned:
+            self.trace.close()
+
+    def first_value_above(self, threshold, uid=None):
+        """The first Hit where the value of the dot uid, or of any dot, was greater than threshold, or None."""
+        return self._first(uid, threshold, above=True)
+
+    def first_value_below(self, threshold, uid=None):
+        """The first Hit where the value of the dot uid, or of any dot, was less than threshold, or None."""
+        return self._first(uid, threshold, above=False)
+
+    def _first(self, uid, threshold, above):
+        index = self.trace.queries
+        if uid is None and index.exact_records:
+            hit = index.first_above_any(threshold) if above else index.first_below_any(threshold)
+            return hit and Hit(*hit)
+
+        # the first of each dot
+        best = None
+        for dot in (index.uids if uid is None else (uid,)):
+            if index.exact(dot):
+                tick = index.first_above(dot, threshold) if above else index.first_below(dot, threshold)
+            else:
+                # the values too big for a float are compared one by one
+                match = (lambda value: value > threshold) if above else (lambda value: value < threshold)
+                tick = self.first_value(dot, match)
+            if tick is not None and (best is None or tick < best.tick):
+                best = Hit(tick, dot)
+        return best
+
+    def first_value(self, uid, predicate):
+        """
+        The first tick where predicate(value) was true for the dot uid, or None.
+
+        The values of the dot are read one by one, prefer first_value_above()
+        and first_value_below() when they are enough.
+        """
+        dot = self.trace.lineage.get(uid)
+        if dot is None:
+            return None
+        for tick, value in zip(dot.value_ticks, dot.values):
+            if predicate(value):
+                return tick
+        return None
+
+    def ticks_on_cell(self, col, row, start=0, stop=None):
+        """
+        The ticks from start to stop (excluded) when at least one dot was on the cell.
+
+        :return: a list of (first, last + 1) ranges, in order
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        bounds = self.trace.queries.cell_bounds(col, row)
+        # the bounds alternate starts and ends, the interval containing start begins at an even index
+        i = bisect_right(bounds, start)
+        i -= i % 2
+        ranges = []
+        while i < len(bounds) and bounds[i] < stop:
+            ranges.append((max(bounds[i], start), min(bounds[i + 1], stop)))
+            i += 2
+        return ranges
+
+    def output_ticks(self, start=0, stop=None):
+        """The ticks from start to stop (excluded) that printed something, once each even if they printed more."""
+        outputs = self.trace.outputs
+        first = outputs.count_until(start - 1)
+        last = len(outputs) if stop is None else outputs.count_until(stop - 1)
+        return list(dict.fromkeys(outputs.ticks[first:last]))
+
+    def outputs(self, start=0, stop=None):
+        """The outputs printed from start to stop (excluded), as (tick, text)."""
+        outputs = self.trace.outputs
+        last = len(outputs) if stop is None else outputs.count_until(stop - 1)
+        return [outputs[i] for i in range(outputs.count_until(start - 1), last)]
@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from functools import lru_cache
 
 import pygame
@@ -5,15 +6,125 @@ import pygame
 from dots.vector import Pos
 
 
+class AtlasPage:
+    """
+    A surface where glyphs are packed in rows, as they are drawn.
+
+    Each glyph is kept as a subsurface of the page, so blitting it is just a
+    blit of a part of the page. The page doubles its height when it's full.
+    """
+
+    WIDTH = 1024  # in pixels
+
+    def __init__(self, alpha):
+        """
+        :param bool alpha: whether the glyphs have a transparent background
+        """
+        self.alpha = alpha
+        self.surface = None  # type: pygame.SurfaceType
+        self.glyphs = {}  # type: Dict[tuple, pygame.SurfaceType]
+        self.rects = {}  # type: Dict[tuple, pygame.Rect]
+        self.x = 0
+        self.y = 0
+        self.row_height = 0
+
+    @property
+    def memory(self):
+        """Size of the page in bytes."""
+        if self.surface is None:
+            return 0
+        return self.surface.get_width() * self.surface.get_height() * self.surface.get_bytesize()
+
+    def get(self, key):
+        return self.glyphs.get(key)
+
+    def add(self, key, glyph):
+        """Copy the glyph surface on the page and return its subsurface."""
+        width, height = glyph.get_size()
+        width = min(width, self.WIDTH)
+
+        if self.x + width > self.WIDTH:
+            # next row
+            self.x = 0
+            self.y += self.row_height
+            self.row_height = 0
+
+        if self.surface is None or self.y + height > self.surface.get_height():
+            self._grow(self.y + height)
+
+        rect = pygame.Rect(self.x, self.y, width, height)
+        self.surface.blit(glyph, rect)
+        self.rects[key] = rect
+        self.glyphs[key] = self.surface.subsurface(rect)
+
+        self.x += width
+        self.row_height = max(self.row_height, height)
+        return self.glyphs[key]
+
+    def _grow(self, min_height):
+        height = 64 if self.surface is None else self.surface.get_height()
+        while height < min_height:
+            height *= 2
+
+        flags = pygame.SRCALPHA if self.alpha else 0
+        surface = pygame.Surface((self.WIDTH, height), flags, 32)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha() if self.alpha else surface.convert()
+        if self.alpha:
+            surface.fill((0, 0, 0, 0))
+
+        if self.surface is not None:
+            surface.blit(self.surface, (0, 0))
+        self.surface = surface
+        # the subsurfaces must point to the new surface, or the old one is kept alive
+        self.glyphs = {key: surface.subsurface(rect) for key, rect in self.rects.items()}
+
+
+class GlyphAtlas:
+    """All the glyphs drawn with a font at one size, in two pages: with and without background."""
+
+    def __init__(self, font_name, size):
+        if not pygame.font.get_init():
+            pygame.font.init()
+        self.size = size
+        self.font = pygame.font.Font(font_name, size)
+        self.char_size = Pos(self.font.size("."))
+        self.pages = (AtlasPage(alpha=False), AtlasPage(alpha=True))
+
+    @property
+    def memory(self):
+        """Size of the pages in bytes."""
+        return sum(page.memory for page in self.pages)
+
+    def glyph(self, char, color, bg=None):
+        """The surface with char drawn in color on bg, or on a transparent background if bg is None."""
+        page = self.pages[bg is None]
+        key = char, color, bg
+        glyph = page.get(key)
+        if glyph is None:
+            glyph = page.add(key, self.font.render(char, True, color, bg))
+        return glyph
+
+
 class Font:
-    """A wrapper around the pygame font system that caches the surfaces."""
+    """
+    A wrapper around the pygame font system that caches the surfaces.
+
+    The chars are drawn once in a GlyphAtlas for each size. The atlases of the
+    sizes used recently are kept to zoom back quickly, as long as they all take
+    less than ATLAS_BUDGET bytes. The atlas of a size is made when it is first
+    used, so fonts can be created before pygame is initialised.
+    """
+
+    ATLAS_BUDGET = 16 * 2 ** 20  # bytes
 
     def __init__(self, name, size):
         self._dependant_caches = []
+        self._atlases = OrderedDict()  # type: Dict[int, GlyphAtlas]
         self.font_name = name
         self.font_size = round(size)
-        self.char_size = None
-        self.font = self.set_size(size)  # type: pygame.font.FontType
+        self._atlas = None  # type: GlyphAtlas
+        self.set_size(size)
 
     def set_size(self, new_size):
         """Chage the size of the font but keep it between 80 and 2."""
@@ -21,15 +132,38 @@ class Font:
         self.font_size = min(80, max(2, round(new_size)))
 
         # clear all caches
-        self.render_char.cache_clear()
         self.render_text.cache_clear()
         for dep in self._dependant_caches:
             dep.cache_clear()
 
-        font = pygame.font.Font(self.font_name, self.font_size)
-        self.char_size = Pos(font.size("."))
-        self.font = font
-        return font
+        # the atlas of the new size is found or made when needed
+        self._atlas = None
+
+    @property
+    def atlas(self):
+        """The GlyphAtlas of the current size."""
+        if self._atlas is None:
+            atlas = self._atlases.get(self.font_size)
+            if atlas is None:
+                atlas = self._atlases[self.font_size] = GlyphAtlas(self.font_name, self.font_size)
+            self._atlases.move_to_end(self.font_size)
+            self._atlas = atlas
+            self.evict()
+        return self._atlas
+
+    @property
+    def char_size(self):
+        return self.atlas.char_size
+
+    @property
+    def font(self):
+        """:rtype: pygame.font.FontType"""
+        return self.atlas.font
+
+    def evict(self):
+        """Forget the atlases of the sizes not used for the longest time, until they fit in the budget."""
+        while len(self._atlases) > 1 and sum(a.memory for a in self._atlases.values()) > self.ATLAS_BUDGET:
+            self._atlases.popitem(last=False)
 
     def change_size(self, delta):
         """Increase or decrease the font size by delta."""
@@ -39,10 +173,9 @@ class Font:
         """Determine the amount of space needed to render text."""
         return self.font.size(text)
 
-    @lru_cache(maxsize=None)
     def render_char(self, char, color, bg=None):
-        """Draw char on a new surface. The result is allways cached."""
-        return self.font.render(char, True, color, bg)  # type: pygame.SurfaceType
+        """Draw char on a new surface. The result is allways cached, in the atlas of the current size."""
+        return self.atlas.glyph(char, color, bg)  # type: pygame.SurfaceType
 
     @lru_cache(maxsize=128)
     def render_text(self, text, color, bg=None):
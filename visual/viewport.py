@@ -0,0 +1,49 @@
+from array import array
+
+try:
+    # numpy is optional, it places thousands of dots at once
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def visible_cells(cols, rows, offset, char_size, screen_size):
+    """
+    The distinct cells that are on the screen, with their position on it.
+
+    Cells are given by two columns of the same length, usually the col and row
+    of the dots of a ticks.Frame, so several dots on the same cell give it once.
+
+    :param offset: the position on the screen of the top left of the map
+    :return: a list of (col, row, x, y)
+    """
+    if not len(cols):
+        return []
+    if numpy is not None and isinstance(cols, array) and isinstance(rows, array):
+        return _visible_cells_numpy(cols, rows, offset, char_size, screen_size)
+
+    char_width, char_height = char_size
+    screen_width, screen_height = screen_size
+    cells = []
+    for col, row in set(zip(cols, rows)):
+        x = offset[0] + char_width * col
+        y = offset[1] + char_height * row
+        if -char_width < x < screen_width and -char_height < y < screen_height:
+            cells.append((col, row, x, y))
+    return cells
+
+
+def _visible_cells_numpy(cols, rows, offset, char_size, screen_size):
+    # the columns of the frames are read in place
+    cols = numpy.frombuffer(cols, dtype='i%d' % cols.itemsize)
+    rows = numpy.frombuffer(rows, dtype='i%d' % rows.itemsize)
+
+    xs = offset[0] + char_size[0] * cols
+    ys = offset[1] + char_size[1] * rows
+    visible = (xs > -char_size[0]) & (xs < screen_size[0]) & (ys > -char_size[1]) & (ys < screen_size[1])
+    cols, rows, xs, ys = cols[visible], rows[visible], xs[visible], ys[visible]
+
+    # one (row, col) key per cell, to keep only the first dot of each
+    keys = (rows.astype(numpy.int64) << 32) + (cols.astype(numpy.int64) + 2 ** 31)
+    _, first = numpy.unique(keys, return_index=True)
+    return list(zip(cols[first].tolist(), rows[first].tolist(), xs[first].tolist(), ys[first].tolist()))